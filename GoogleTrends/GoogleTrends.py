@@ -1,13 +1,26 @@
 from pytrends.request import TrendReq
+from pytrends.exceptions import ResponseError
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import pandas as pd
 from GoogleTrends import utils
 from GoogleTrends.datehandler import datehandler
+from GoogleTrends import ratelimit
+from GoogleTrends.ratelimit import TokenBucket
+from GoogleTrends.cache import ResponseCache
+from GoogleTrends import planner
+from GoogleTrends.planner import MAX_KEYWORDS
 
 
 class GoogleTrends:
     """Class to pull Google Trends data"""
 
+    trend_req = TrendReq
+
     def __init__(
         self,
         client_name,
@@ -16,16 +29,129 @@ class GoogleTrends:
         start_date=None,
         freq="weekly",
         region="US",
+        concurrent=False,
+        max_workers=4,
+        request_interval=1.0,
+        cache_dir=None,
+        cache_ttl=24 * 60 * 60,
+        anchor=None,
+        rate_limit_file=None,
+        max_retries=5,
     ):
 
         self.client_name = client_name
         self.kw_list = keywords
+        self.anchor = anchor or keywords[0]
         self.frequency = freq
         self.input_end_date = end_date
         self.input_start_date = start_date
         self.datehandler = datehandler(freq, end_date, start_date)
         self.geo = region
         self.scaled = False
+        self.concurrent = concurrent
+        self.max_workers = max_workers
+        self.rate_limiter = TokenBucket(
+            rate=1 / request_interval if request_interval else None,
+            path=rate_limit_file,
+        )
+        self.max_retries = max_retries
+        self.stats = {"requests": 0, "retries": 0, "sleep_time": 0.0}
+        self._stats_lock = threading.Lock()
+        self.cache = ResponseCache(cache_dir, ttl=cache_ttl) if cache_dir else None
+        self._sessions = queue.LifoQueue()
+
+    @contextmanager
+    def _get_session(self):
+        """Lends a pytrends session from this object's pool, creating one (and doing the cookie handshake) only if none is free.
+
+        build_payload stores the payload on the session, so a session is used by one request at a time,
+        and given back to the pool once the request is done. Sessions are shared by every thread of every thread pool,
+        so there are never more sessions than concurrent requests.
+        A session whose request failed isn't given back.
+
+        Yields:
+            TrendReq: pytrends session
+        """
+        try:
+            session = self._sessions.get_nowait()
+        except queue.Empty:
+            session = self.trend_req()
+        yield session
+        self._sessions.put(session)
+
+    def _count(self, name: str, value=1):
+        with self._stats_lock:
+            self.stats[name] += value
+
+    def _fetch_payload(self, kw_list: list, timeframe: str) -> pd.DataFrame:
+        """Fetches data for one payload (at most 5 keywords) for the given timeframe
+
+        If a cache directory was given, responses are served from / saved into the on-disk cache (see cache.py).
+        Every request waits for the rate limiter (see ratelimit.TokenBucket).
+        When Google returns a 429 or a 5xx, only this request is retried (up to `max_retries` times)
+        with a new session, after an exponential backoff with jitter (see ratelimit.get_backoff).
+        Requests, retries & seconds spent sleeping are counted in `stats`.
+
+        Args:
+            kw_list (list): keywords of the payload
+            timeframe (str): timeframe (format= f"{start_date:%Y-%m-%d} {end_date:%Y-%m-%d}")
+
+        Returns:
+            pd.DataFrame: Raw data from Google Trends
+        """
+        if self.cache is not None:
+            df = self.cache.get(kw_list, timeframe, self.geo)
+            if df is not None:
+                return df
+        for attempt in range(self.max_retries + 1):
+            self._count("sleep_time", self.rate_limiter.acquire())
+            self._count("requests")
+            try:
+                with self._get_session() as gtrends:
+                    gtrends.build_payload(timeframe=timeframe, kw_list=kw_list, geo=self.geo)
+                    df = gtrends.interest_over_time().drop("isPartial", axis=1)
+                break
+            except ResponseError as e:
+                if attempt == self.max_retries or not ratelimit.is_retryable(e):
+                    raise
+                delay = ratelimit.get_backoff(attempt)
+                print(f"{e} Retrying {timeframe} {kw_list} in {delay:.1f}s.")
+                self._count("retries")
+                self._count("sleep_time", delay)
+                time.sleep(delay)
+        if self.cache is not None:
+            self.cache.set(kw_list, timeframe, self.geo, df)
+        return df
+
+    def _fetch_batched(self, timeframe: str) -> pd.DataFrame:
+        """Fetches data for more than 5 keywords for the given timeframe
+
+        The keywords are split into payloads that all contain the anchor keyword (see utils.get_keyword_batches),
+        which are fetched concurrently. Each payload is then scaled so its anchor matches the anchor of the first payload,
+        and the result is normalized so that the max value is 100, like a single payload would be.
+
+        Args:
+            timeframe (str): timeframe (format= f"{start_date:%Y-%m-%d} {end_date:%Y-%m-%d}")
+
+        Returns:
+            pd.DataFrame: Data from Google Trends, as if all keywords were in one payload
+        """
+        batches = utils.get_keyword_batches(self.kw_list, self.anchor, MAX_KEYWORDS)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            df_list = list(
+                executor.map(lambda kws: self._fetch_payload(kws, timeframe), batches)
+            )
+        anchor_sums = [df[self.anchor].sum() for df in df_list]
+        if 0 in anchor_sums:
+            raise ValueError(
+                f"Anchor keyword '{self.anchor}' has no data between {timeframe}, can't scale the keyword batches. Use a more popular anchor."
+            )
+        scaled = [df_list[0]] + [
+            df.drop(self.anchor, axis=1) * (anchor_sums[0] / anchor_sum)
+            for df, anchor_sum in zip(df_list[1:], anchor_sums[1:])
+        ]
+        df = pd.concat(scaled, axis=1)[self.kw_list]
+        return self.normalize_to_100(df)
 
     def _fetch(self, timeframe: str) -> pd.DataFrame:
         """Fetches data for the given timeframe
@@ -36,9 +162,9 @@ class GoogleTrends:
         Returns:
             pd.DataFrame: Raw data from Google Trends
         """
-        gtrends = TrendReq()
-        gtrends.build_payload(timeframe=timeframe, kw_list=self.kw_list, geo=self.geo)
-        return gtrends.interest_over_time().drop("isPartial", axis=1)
+        if len(self.kw_list) > MAX_KEYWORDS:
+            return self._fetch_batched(timeframe)
+        return self._fetch_payload(self.kw_list, timeframe)
 
     def get_unscaled_data(
         self, start_date: datetime, end_date: datetime
@@ -55,26 +181,30 @@ class GoogleTrends:
         tf = utils.to_timeframe(start_date, end_date)
         return self._fetch(tf)
 
-    def get_df_list(self):
+    def get_df_list(self, freq=None):
         """Gets a list of dataframes and list of overlapping dates
 
         If we'd like to fetch data with more granularity for a larger date range, say more than 7 days of daily data,
         we'll have to make several requests in 7 day blocks from the start date to the end date.
         This method will make those repeated requests in cases of date ranges that are larger than the allowed range for daily/weekly data.
 
+        Args:
+            freq (str, optional): granularity of the windows ("daily" or "weekly"). Defaults to the frequency of this object.
+
         Returns:
             df_list (List): List of pandas dataframes that we would merge later
             op_date_list (List): List of overlapping dates
         """
+        freq = freq or self.frequency
         current_start = self.datehandler.end_date
         current_end = self.datehandler.end_date
         df_list = []
         op_date_list = []
 
         while not utils.less_than_gt_range(
-            self.datehandler.start_date, current_end, self.frequency
+            self.datehandler.start_date, current_end, freq
         ):  # while the date range is more than the allowed range
-            current_start = utils.get_start_date(current_start, self.frequency)
+            current_start = utils.get_start_date(current_start, freq)
             df = self.get_unscaled_data(current_start, current_end)
             op_date = utils.get_overlapping_date(df, self.kw_list)
             op_date_list.append(op_date)
@@ -84,27 +214,38 @@ class GoogleTrends:
 
         if (
             utils.less_than_270d(self.datehandler.start_date, current_end)
-            and self.frequency == "weekly"
+            and freq == "weekly"
         ):
-            raw = self.get_unscaled_for(self.datehandler.start_date, current_end)
-            df = self.get_avg(raw)
+            raw = self.get_unscaled_data(self.datehandler.start_date, current_end)
+            df = self.get_avg(raw, freq)
         else:
-            df = self.get_unscaled_for(self.datehandler.start_date, current_end)
+            df = self.get_unscaled_data(self.datehandler.start_date, current_end)
         print(f"{self.datehandler.start_date:%Y-%m-%d} {current_end:%Y-%m-%d}")
         df_list.append(df)
         return df_list, op_date_list
 
-    def _scale(self, upper_df: pd.DataFrame, lower_df: pd.DataFrame, op_date):
-        min_date_upper = upper_df.index.min()
-        op_upper_df = upper_df.loc[:op_date, :]
-        op_lower_df = lower_df.loc[min_date_upper:, :]
-        numerators = {k: op_upper_df.loc[:, k].sum() for k in self.kw_list}
-        denominators = {k: op_lower_df.loc[:, k].sum() for k in self.kw_list}
-        for k in self.kw_list:
-            scale = numerators[k] / denominators[k]
-            lower_df[k] = lower_df[k].apply(lambda x: x * scale)
-        lower_df.drop(op_lower_df.index, inplace=True)
-        return upper_df.append(lower_df).sort_index()
+    def get_planned_df_list(self, freq=None):
+        """Gets the same lists as get_df_list, but plans every window up front and fetches them concurrently.
+
+        get_df_list can't request a window before it has picked the overlapping date of the previous one.
+        Here the windows share a fixed overlap (see utils.get_windows), so they're all requested at once
+        through a thread pool of `max_workers` threads, spaced out by the rate limiter.
+        The overlapping date of each pair of windows is the last date of the older window.
+
+        Args:
+            freq (str, optional): granularity of the windows ("daily" or "weekly"). Defaults to the frequency of this object.
+
+        Returns:
+            df_list (List): List of pandas dataframes that we would merge later, newest first
+            op_date_list (List): List of overlapping dates
+        """
+        windows = utils.get_windows(
+            self.datehandler.start_date, self.datehandler.end_date, freq or self.frequency
+        )
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            df_list = list(executor.map(lambda w: self.get_unscaled_data(*w), windows))
+        op_date_list = [df.index.max() for df in df_list[1:]]
+        return df_list, op_date_list
 
     def normalize_to_100(self, df: pd.DataFrame):
         """Makes sure the final scaled dataframe's max value is 100
@@ -115,19 +256,69 @@ class GoogleTrends:
         Returns:
             pd.DataFrame: final dataframe, normalized so that the max value is 100
         """
-        max_val = df.max().max()
-        return df.apply(lambda x: x / max_val * 100)
+        return df / df.max().max() * 100
+
+    def get_scaled_data(self, freq=None):
+        """Fetches all the windows needed for the date range, and scales them into one dataframe (see utils.stitch)
+
+        Args:
+            freq (str, optional): granularity of the windows ("daily" or "weekly"). Defaults to the frequency of this object.
 
-    def get_scaled_data(self):
+        Returns:
+            pd.DataFrame: scaled data, normalized so that the max value is 100
+        """
         self.scaled = True
-        df_list, op_date_list = self.get_df_list()
-        df = self._scale(df_list[0], df_list[1], op_date_list[0])
-        if len(df_list) > 2:
-            for i in range(2, len(df_list)):
-                df = self._scale(df, df_list[i], op_date_list[i - 1])
-        return self.normalize_to_100(df)
+        if self.concurrent:
+            df_list, op_date_list = self.get_planned_df_list(freq)
+        else:
+            df_list, op_date_list = self.get_df_list(freq)
+        return utils.stitch(df_list, op_date_list)
+
+    def get_incremental_data(self, history: pd.DataFrame) -> pd.DataFrame:
+        """Fetches only the dates after a previously stored scaled series, scales them to it and appends them.
 
-    def get_avg(self, df):
+        Instead of fetching the whole date range again, this makes a single request: one window (the largest range that still
+        returns daily/weekly data) ending on the end date. The dates this window shares with the history are used to scale it,
+        the same way windows are scaled to each other (see utils.get_overlapping_date & utils.stitch).
+        The history keeps its values, so the new dates may go above 100.
+        Monthly data is always a single request (see planner.get_plans), so it's simply fetched again.
+
+        Args:
+            history (pd.DataFrame): previously stored data, indexed by date, one column per keyword (see utils.to_wide)
+
+        Raises:
+            ValueError: if the history doesn't overlap the window that would be fetched
+
+        Returns:
+            pd.DataFrame: history with the new dates appended
+        """
+        if self.frequency == "monthly":
+            return self.get_data()
+        self.scaled = True
+        last_date = history.index.max()
+        if last_date >= self.datehandler.end_date:
+            return history
+        window_start = utils.get_start_date(self.datehandler.end_date, self.frequency)
+        if last_date < window_start:
+            raise ValueError(
+                f"History ends on {last_date:%Y-%m-%d}, before the earliest date that can be fetched in one request ({window_start:%Y-%m-%d}). Fetch the whole date range instead."
+            )
+        print(
+            f"Getting Google Trends Data incrementally...\nFrequency: {self.frequency}\nKeywords: {self.kw_list}\nDate Range: {last_date:%Y-%m-%d} - {self.datehandler.end_date:%Y-%m-%d}"
+        )
+        df = self.get_unscaled_data(window_start, self.datehandler.end_date)
+        overlap = df.loc[:last_date, self.kw_list]
+        op_date = utils.get_overlapping_date(overlap, self.kw_list)
+        numerators = history.loc[overlap.index.min() : op_date, self.kw_list].sum()
+        denominators = overlap.loc[:op_date].sum()
+        if (denominators == 0).any():
+            raise ValueError(
+                f"No overlapping data for {list(denominators[denominators == 0].index)}, can't scale to the history."
+            )
+        tail = df.loc[df.index > last_date, self.kw_list] * (numerators / denominators)
+        return pd.concat([history[self.kw_list], tail])
+
+    def get_avg(self, df, freq=None):
         """Gets the avg values of the Google Trends data.
 
         This is used in the case when we'd like less granularity than what is given by the Google Trends API.
@@ -135,68 +326,80 @@ class GoogleTrends:
 
         Args:
             df (pd.DataFrame): Raw data from Google Trends.
+            freq (str, optional): desired granularity ("weekly" or "monthly"). Defaults to the frequency of this object.
 
         Returns:
             pd.DataFrame: Data averaged to the desired granularity.
         """
-        idx_name = df.index.name
-        df.reset_index(inplace=True)
-        if self.frequency == "weekly":
-            df["gt_date"] = df[idx_name].apply(utils.get_week_start)
-        elif self.frequency == "monthly":
-            df["gt_date"] = df[idx_name].apply(utils.first_of_month)
-        df.drop(idx_name, axis=1, inplace=True)
-        return df.groupby(["gt_date"]).mean()
-
-    def get_dailydata(self):
-        if utils.less_than_270d(self.datehandler.start_date, self.datehandler.end_date):
+        freq = freq or self.frequency
+        if freq == "weekly":
+            periods = df.index.to_period("W-SAT")
+        elif freq == "monthly":
+            periods = df.index.to_period("M")
+        return df.groupby(periods.start_time.rename("gt_date")).mean()
+
+    def get_plans(self) -> list:
+        """Lists every plan that returns data for the frequency & date range of this object (see planner.get_plans)
+
+        Returns:
+            list: list of Plans
+        """
+        return planner.get_plans(self.datehandler, len(self.kw_list))
+
+    def run_plan(self, plan) -> pd.DataFrame:
+        """Fetches data following the given plan
+
+        Args:
+            plan (planner.Plan): plan to run
+
+        Returns:
+            pd.DataFrame: data at the frequency of this object
+        """
+        if plan.method == "stitch":
+            df = self.get_scaled_data(plan.fetch_freq)
+        else:
             df = self.get_unscaled_data(
                 self.datehandler.start_date, self.datehandler.end_date
             )
-        else:
-            df = self.get_scaled_data()
+        if plan.fetch_freq != self.frequency:
+            df = self.get_avg(df)
         return df
 
-    def get_weeklydata(self):
-        if utils.less_than_270d(self.datehandler.start_date, self.datehandler.end_date):
-            df = self.get_unscaled_for(
-                self.datehandler.start_date, self.datehandler.end_date
-            )
-            return self.get_avg(df)
-        elif utils.less_than_270w(
-            self.datehandler.start_date, self.datehandler.end_date
-        ):
-            return self.get_unscaled_data(
-                self.datehandler.start_date, self.datehandler.end_date
-            )
-        else:
-            return self.get_scaled_data()
+    def get_data(self, dry_run=False):
+        """Fetches data for the frequency & date range of this object, using the plan with the least requests (see planner.py)
 
-    def get_monthlydata(self):
-        df = self.get_unscaled_data(
-            self.datehandler.start_date, self.datehandler.end_date
-        )
-        if utils.less_than_270w(self.datehandler.start_date, self.datehandler.end_date):
-            return self.get_avg(df)
-        else:
-            return df
+        Args:
+            dry_run (bool, optional): only print & return the plans, without fetching anything. Defaults to False.
 
-    def get_data(self):
+        Returns:
+            pd.DataFrame: data from Google Trends (list of Plans if dry_run)
+        """
+        plans = self.get_plans()
+        plan = planner.choose(plans)
         print(
-            f"Getting Google Trends Data...\nFrequency: {self.frequency}\nKeywords: {self.kw_list}\nDate Range: {self.datehandler.start_date} - {self.datehandler.end_date}"
+            f"Getting Google Trends Data...\nFrequency: {self.frequency}\nKeywords: {self.kw_list}\nDate Range: {self.datehandler.start_date} - {self.datehandler.end_date}\nPlans:\n{planner.describe(plans, plan)}"
         )
-        if self.frequency == "daily":
-            return self.get_dailydata()
-        elif self.frequency == "weekly":
-            return self.get_weeklydata()
-        elif self.frequency == "monthly":
-            return self.get_monthlydata()
+        if dry_run:
+            return plans
+        return self.run_plan(plan)
 
     def add_details_to_df(self, raw_data):
+        """Melts the data into one row per date & keyword, and adds details about the request.
+
+        The keyword and the details are stored as categoricals (see utils.constant_column),
+        so each distinct value is stored once however many rows there are. They're expanded back when written to CSV.
+
+        Args:
+            raw_data (pd.DataFrame): data indexed by date, one column per keyword
+
+        Returns:
+            pd.DataFrame: final data
+        """
         rawd = raw_data.reset_index().rename(columns={"gt_date": "date"})
         df = pd.melt(
             rawd, id_vars=["date"], value_vars=self.kw_list, var_name="keyword"
         )
+        df["keyword"] = df["keyword"].astype("category")
         new_cols_dict = {
             "client": self.client_name,
             "region": self.geo,
@@ -209,11 +412,23 @@ class GoogleTrends:
             "keywords_queried": str(self.kw_list),
         }
         for colname, value in new_cols_dict.items():
-            df[colname] = value
+            df[colname] = utils.constant_column(value, len(df))
         return df
 
-    def get_final_data(self):
-        raw_data = self.get_data().apply(round).astype("int")
+    def get_final_data(self, history=None):
+        """Gets the data in its final format (one row per date & keyword, with details about the request)
+
+        Args:
+            history (pd.DataFrame, optional): final data of a previous run. If given, only the new dates are fetched (see get_incremental_data). Defaults to None.
+
+        Returns:
+            pd.DataFrame: final data
+        """
+        if history is None:
+            data = self.get_data()
+        else:
+            data = self.get_incremental_data(utils.to_wide(history))
+        raw_data = data.apply(round).astype("int")
         return self.add_details_to_df(raw_data)
 
     def get_fname(self):
@@ -0,0 +1,106 @@
+import argparse
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from GoogleTrends import utils
+from GoogleTrends.GoogleTrends import GoogleTrends
+
+PARTITION_COLS = ["client", "region"]
+
+
+def load_manifest(path) -> list:
+    """Loads a manifest of GoogleTrends requests.
+
+    The manifest is a JSON list, each item holds the arguments of one GoogleTrends object, e.g.
+    {"client_name": "client", "keywords": ["kw1", "kw2"], "region": "US", "freq": "weekly", "start_date": "2020-01-01", "end_date": null}
+
+    Args:
+        path (str): path of the JSON manifest
+
+    Returns:
+        list: list of GoogleTrends arguments
+    """
+    with open(path) as f:
+        return json.load(f)
+
+
+def _run_entry(entry, output_dir, request_interval, rate_limit_file, kwargs):
+    gt = GoogleTrends(
+        **entry,
+        **kwargs,
+        request_interval=request_interval,
+        rate_limit_file=rate_limit_file,
+    )
+    df = gt.get_final_data()
+    print(f"{entry['client_name']}: {gt.stats}")
+    return utils.write_partitioned(df, output_dir, PARTITION_COLS, gt.get_fname())
+
+
+def run_manifest(
+    manifest, output_dir, processes=4, request_interval=1.0, **kwargs
+) -> list:
+    """Runs every request of a manifest across a process pool, and writes all the final data into one partitioned output.
+
+    All processes share the same rate limiter (a token bucket stored in a local file, see ratelimit.TokenBucket),
+    so the whole batch starts at most one request every `request_interval` seconds.
+    The final data of each request is written to output_dir/client=<client>/region=<region>/<GoogleTrends.get_fname()>.
+    A failed request doesn't stop the others, failures are raised together once the batch is done.
+
+    Args:
+        manifest (list or str): list of GoogleTrends arguments, or path of a JSON manifest (see load_manifest)
+        output_dir (str): root folder of the partitioned output
+        processes (int, optional): number of processes. Defaults to 4.
+        request_interval (float, optional): min number of seconds between two requests, across all processes. Defaults to 1.0.
+        **kwargs: other GoogleTrends arguments applied to every request (e.g. concurrent, cache_dir)
+
+    Raises:
+        RuntimeError: if any request failed
+
+    Returns:
+        list: paths of the files written
+    """
+    if isinstance(manifest, str):
+        manifest = load_manifest(manifest)
+    paths = []
+    failures = []
+    fd, rate_limit_file = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    try:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = {
+                executor.submit(
+                    _run_entry,
+                    entry,
+                    output_dir,
+                    request_interval,
+                    rate_limit_file,
+                    kwargs,
+                ): entry
+                for entry in manifest
+            }
+            for future in as_completed(futures):
+                entry = futures[future]
+                try:
+                    paths.extend(future.result())
+                    print(f"Done: {entry['client_name']} {entry.get('region', 'US')}")
+                except Exception as e:
+                    print(f"Failed: {entry['client_name']} {entry.get('region', 'US')}: {e}")
+                    failures.append((entry, e))
+    finally:
+        os.remove(rate_limit_file)
+    if failures:
+        raise RuntimeError(
+            f"{len(failures)} of {len(manifest)} requests failed: {[(entry['client_name'], str(e)) for entry, e in failures]}"
+        )
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs a manifest of Google Trends requests.")
+    parser.add_argument("manifest", help="path of the JSON manifest")
+    parser.add_argument("output_dir", help="root folder of the partitioned output")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--request-interval", type=float, default=1.0)
+    args = parser.parse_args()
+    run_manifest(args.manifest, args.output_dir, args.processes, args.request_interval)
@@ -0,0 +1,182 @@
+import argparse
+import threading
+import time
+import tracemalloc
+import zlib
+import numpy as np
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+from GoogleTrends import utils
+from GoogleTrends.cache import ResponseCache
+from GoogleTrends.GoogleTrends import GoogleTrends
+
+END_DATE = "2022-06-30"
+
+
+class ReplayTrendReq:
+    """Stand-in for pytrends' TrendReq that never calls Google.
+
+    interest_over_time replays the frame recorded for the same request in `recorded_dir` (a ResponseCache directory,
+    e.g. the cache_dir of a real run), or builds a synthetic frame with the granularity Google would return for the timeframe.
+    """
+
+    recorded_dir = None
+    requests = 0
+    _lock = threading.Lock()
+
+    def __init__(self):
+        self.cache = ResponseCache(self.recorded_dir, ttl=float("inf")) if self.recorded_dir else None
+
+    def build_payload(self, kw_list, timeframe, geo="US"):
+        self.kw_list = kw_list
+        self.timeframe = timeframe
+        self.geo = geo
+
+    def _synthetic(self) -> pd.DataFrame:
+        start, end = [utils.to_dt(d) for d in self.timeframe.split()]
+        if utils.less_than_270d(start, end):
+            idx = pd.date_range(start, end, freq="D", name="date")
+        elif utils.less_than_270w(start, end):
+            idx = pd.date_range(start - relativedelta(days=start.isoweekday() % 7), end, freq="W-SUN", name="date")
+        else:
+            idx = pd.date_range(start.replace(day=1), end, freq="MS", name="date")
+        # stable seed (str hashes change between processes), so every run gets the same frames
+        rng = np.random.default_rng(zlib.crc32(repr((self.kw_list, self.timeframe)).encode("utf-8")))
+        walk = np.abs(rng.normal(0, 1, (len(idx), len(self.kw_list))).cumsum(axis=0)) + 1
+        values = np.round(walk / walk.max() * 100).astype(int)
+        df = pd.DataFrame(values, index=idx, columns=self.kw_list)
+        df["isPartial"] = False
+        return df
+
+    def interest_over_time(self) -> pd.DataFrame:
+        with self._lock:
+            ReplayTrendReq.requests += 1
+        if self.cache is not None:
+            df = self.cache.get(self.kw_list, self.timeframe, self.geo)
+            if df is not None:
+                df = df.copy()
+                df["isPartial"] = False
+                return df
+        return self._synthetic()
+
+
+class BenchmarkGoogleTrends(GoogleTrends):
+    """GoogleTrends fetching from ReplayTrendReq, timing each stage of the pipeline into `timings`"""
+
+    trend_req = ReplayTrendReq
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.timings = {}
+
+    def _timed(self, stage, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        self.timings[stage] = self.timings.get(stage, 0.0) + time.perf_counter() - start
+        return result
+
+    def get_df_list(self, freq=None):
+        return self._timed("df_list", super().get_df_list, freq)
+
+    def get_planned_df_list(self, freq=None):
+        return self._timed("df_list", super().get_planned_df_list, freq)
+
+    def get_scaled_data(self, freq=None):
+        return self._timed("scaled", super().get_scaled_data, freq)
+
+    def get_avg(self, df, freq=None):
+        return self._timed("avg", super().get_avg, df, freq)
+
+    def add_details_to_df(self, raw_data):
+        return self._timed("details", super().add_details_to_df, raw_data)
+
+
+def run_scenario(freq: str, years: int, n_keywords: int, **kwargs) -> dict:
+    """Runs get_final_data offline for one scenario
+
+    Args:
+        freq (str): granularity
+        years (int): number of years until END_DATE
+        n_keywords (int): number of keywords
+        **kwargs: other GoogleTrends arguments (e.g. concurrent)
+
+    Returns:
+        dict: wall time, peak memory, number of simulated requests and time spent in each stage (seconds)
+    """
+    start_date = utils.to_dt(END_DATE) - relativedelta(years=years)
+    gt = BenchmarkGoogleTrends(
+        "benchmark",
+        [f"keyword_{i}" for i in range(n_keywords)],
+        end_date=END_DATE,
+        start_date=f"{start_date:%Y-%m-%d}",
+        freq=freq,
+        request_interval=0,
+        **kwargs,
+    )
+    ReplayTrendReq.requests = 0
+    tracemalloc.start()
+    start = time.perf_counter()
+    df = gt.get_final_data()
+    wall = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    result = {
+        "freq": freq,
+        "years": years,
+        "keywords": n_keywords,
+        "rows": len(df),
+        "requests": ReplayTrendReq.requests,
+        "wall_s": round(wall, 3),
+        "peak_mb": round(peak / 1024 ** 2, 1),
+    }
+    scaled = gt.timings.get("scaled", 0.0)
+    result["df_list_s"] = round(gt.timings.get("df_list", 0.0), 3)
+    result["stitch_s"] = round(scaled - gt.timings.get("df_list", 0.0) if scaled else 0.0, 3)
+    result["avg_s"] = round(gt.timings.get("avg", 0.0), 3)
+    result["details_s"] = round(gt.timings.get("details", 0.0), 3)
+    return result
+
+
+def run(
+    freqs=("daily", "weekly", "monthly"),
+    years=(1, 5, 15),
+    keywords=(1, 5, 20, 100),
+    recorded_dir=None,
+    **kwargs,
+) -> pd.DataFrame:
+    """Runs every combination of frequency, number of years & number of keywords offline
+
+    Args:
+        freqs (tuple, optional): granularities. Defaults to ("daily", "weekly", "monthly").
+        years (tuple, optional): numbers of years. Defaults to (1, 5, 15).
+        keywords (tuple, optional): numbers of keywords. Defaults to (1, 5, 20, 100).
+        recorded_dir (str, optional): ResponseCache directory to replay recorded responses from. Defaults to None (synthetic data).
+        **kwargs: other GoogleTrends arguments (e.g. concurrent)
+
+    Returns:
+        pd.DataFrame: one row per scenario (see run_scenario)
+    """
+    ReplayTrendReq.recorded_dir = recorded_dir
+    results = []
+    for freq in freqs:
+        for y in years:
+            for n in keywords:
+                results.append(run_scenario(freq, y, n, **kwargs))
+                print(results[-1])
+    return pd.DataFrame(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the GoogleTrends pipeline without calling Google.")
+    parser.add_argument("--freqs", nargs="+", default=["daily", "weekly", "monthly"])
+    parser.add_argument("--years", nargs="+", type=int, default=[1, 5, 15])
+    parser.add_argument("--keywords", nargs="+", type=int, default=[1, 5, 20, 100])
+    parser.add_argument("--recorded-dir", help="ResponseCache directory to replay recorded responses from")
+    parser.add_argument("--concurrent", action="store_true", help="fetch windows concurrently")
+    parser.add_argument("--output", help="path of a CSV file to save the results to")
+    args = parser.parse_args()
+
+    results = run(args.freqs, args.years, args.keywords, args.recorded_dir, concurrent=args.concurrent)
+    print(results.to_string(index=False))
+    if args.output:
+        results.to_csv(args.output, index=False)
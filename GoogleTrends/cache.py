@@ -0,0 +1,76 @@
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+import pandas as pd
+
+
+class ResponseCache:
+    """On-disk cache of Google Trends responses, keyed by (kw_list, timeframe, geo).
+
+    Each response is pickled into its own file, so several processes (or reruns) can share the same cache directory.
+    - Entries older than `ttl` seconds are treated as missing and removed.
+    - Once the directory grows past `max_bytes`, the oldest entries are evicted first.
+    """
+
+    def __init__(self, cache_dir, ttl=24 * 60 * 60, max_bytes=500 * 1024 ** 2):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+    def _path(self, kw_list: list, timeframe: str, geo: str) -> Path:
+        key = json.dumps([list(kw_list), timeframe, geo])
+        return self.cache_dir / f"{hashlib.sha256(key.encode()).hexdigest()}.pkl"
+
+    def get(self, kw_list: list, timeframe: str, geo: str):
+        """Returns the cached response, or None if it's missing or expired
+
+        Args:
+            kw_list (list): keywords of the request
+            timeframe (str): timeframe of the request (see utils.to_timeframe)
+            geo (str): region of the request
+
+        Returns:
+            pd.DataFrame: cached data from Google Trends (None if not cached)
+        """
+        path = self._path(kw_list, timeframe, geo)
+        try:
+            age = time.time() - path.stat().st_mtime
+            if age > self.ttl:
+                path.unlink()
+                return None
+            return pd.read_pickle(path)
+        except FileNotFoundError:
+            return None
+
+    def set(self, kw_list: list, timeframe: str, geo: str, df: pd.DataFrame):
+        """Saves a response into the cache, then evicts the oldest entries if the cache is too big.
+
+        Args:
+            kw_list (list): keywords of the request
+            timeframe (str): timeframe of the request (see utils.to_timeframe)
+            geo (str): region of the request
+            df (pd.DataFrame): data from Google Trends
+        """
+        path = self._path(kw_list, timeframe, geo)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        df.to_pickle(tmp_path)
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for p in self.cache_dir.glob("*.pkl"):
+            try:
+                stat = p.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, p))
+        total = sum(size for _, size, _ in entries)
+        for _, size, p in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            p.unlink(missing_ok=True)
+            total -= size
@@ -0,0 +1,99 @@
+import math
+from collections import namedtuple
+from GoogleTrends import utils
+
+MAX_KEYWORDS = 5
+
+Plan = namedtuple("Plan", ["method", "fetch_freq", "windows", "requests"])
+Plan.__doc__ = """A way of fetching data for a frequency & date range.
+
+- method: "native" (one request returning the frequency asked for), "aggregate" (one request returning more granular data, averaged afterwards)
+  or "stitch" (several windows scaled to each other, see utils.stitch)
+- fetch_freq: granularity of the data fetched
+- windows: list of (start_date, end_date) windows fetched
+- requests: estimated number of requests
+"""
+
+
+def get_batch_count(n_keywords: int) -> int:
+    """Returns the number of payloads needed for the given number of keywords (see utils.get_keyword_batches)"""
+    if n_keywords <= MAX_KEYWORDS:
+        return 1
+    return math.ceil((n_keywords - 1) / (MAX_KEYWORDS - 1))
+
+
+def get_plans(dh, n_keywords: int) -> list:
+    """Lists every plan that returns data for the frequency & date range of a datehandler.
+
+    Google Trends decides the granularity of the data from the date range (see README):
+    - Daily data can be fetched natively for < 270 days, or stitched from daily windows.
+    - Weekly data can be fetched natively between 270 days & 270 weeks, averaged from daily data for < 270 days,
+      or stitched from weekly windows (or daily windows, then averaged) for longer ranges.
+    - Monthly data can be fetched natively for >= 270 weeks, or averaged from weekly/daily data for shorter ranges,
+      or from stitched weekly windows.
+    The number of requests of stitched plans is estimated from windows with a fixed overlap (see utils.get_windows).
+    Each window takes one request per keyword payload.
+
+    Args:
+        dh (datehandler): datehandler holding the frequency & date range
+        n_keywords (int): number of keywords
+
+    Returns:
+        list: list of Plans
+    """
+    start, end = dh.start_date, dh.end_date
+    single = [(start, end)]
+    if utils.less_than_270d(start, end):
+        native_freq = "daily"
+    elif utils.less_than_270w(start, end):
+        native_freq = "weekly"
+    else:
+        native_freq = "monthly"
+    freqs = ["daily", "weekly", "monthly"]
+
+    plans = []
+    if native_freq == dh.freq:
+        plans.append(Plan("native", dh.freq, single, 1))
+    elif freqs.index(native_freq) < freqs.index(dh.freq):
+        plans.append(Plan("aggregate", native_freq, single, 1))
+    for fetch_freq in ["daily", "weekly"]:
+        if freqs.index(fetch_freq) > freqs.index(dh.freq):
+            continue
+        if utils.less_than_gt_range(start, end, fetch_freq):
+            continue
+        windows = utils.get_windows(start, end, fetch_freq)
+        plans.append(Plan("stitch", fetch_freq, windows, len(windows)))
+
+    batches = get_batch_count(n_keywords)
+    return [plan._replace(requests=plan.requests * batches) for plan in plans]
+
+
+def choose(plans: list):
+    """Returns the plan with the least requests (the most native one if several plans tie)
+
+    Args:
+        plans (list): list of Plans (see get_plans)
+
+    Returns:
+        Plan: chosen plan
+    """
+    return min(plans, key=lambda plan: plan.requests)
+
+
+def describe(plans: list, chosen=None) -> str:
+    """Describes a list of plans, e.g. for a dry run
+
+    Args:
+        plans (list): list of Plans (see get_plans)
+        chosen (Plan, optional): plan to mark as chosen. Defaults to None.
+
+    Returns:
+        str: one line per plan
+    """
+    lines = []
+    for plan in plans:
+        mark = "*" if plan == chosen else " "
+        lines.append(
+            f"{mark} {plan.method:<9} {plan.fetch_freq:<7} {len(plan.windows):>3} window(s) ~{plan.requests} request(s)"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,88 @@
+import fcntl
+import json
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Token bucket limiting how fast Google Trends requests start.
+
+    The bucket holds up to `capacity` tokens and refills at `rate` tokens per second, each request takes one token.
+    By default the bucket is shared by every thread fetching for the same GoogleTrends object.
+    If a `path` is given, the bucket is stored in that (local) file and locked while it's updated,
+    so several processes or jobs on the same host share the same budget (see batch.py).
+    A rate of None means no limit.
+    """
+
+    def __init__(self, rate: float = 1.0, capacity: int = 1, path=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.path = path
+        self._lock = threading.Lock()
+        self._state = {"tokens": capacity, "time": time.time()}
+
+    @contextmanager
+    def _locked_state(self):
+        if self.path is None:
+            with self._lock:
+                yield self._state
+            return
+        with open(self.path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                content = f.read()
+                state = json.loads(content) if content else {"tokens": self.capacity, "time": time.time()}
+                yield state
+                f.seek(0)
+                f.truncate()
+                json.dump(state, f)
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def acquire(self) -> float:
+        """Blocks until a token is available and takes it.
+
+        Returns:
+            float: seconds spent waiting
+        """
+        if self.rate is None:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self._locked_state() as state:
+                now = time.time()
+                tokens = min(self.capacity, state["tokens"] + (now - state["time"]) * self.rate)
+                state["time"] = now
+                if tokens >= 1:
+                    state["tokens"] = tokens - 1
+                    return waited
+                state["tokens"] = tokens
+                wait = (1 - tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+def get_backoff(attempt: int, base: float = 2.0, cap: float = 120.0) -> float:
+    """Returns how long to wait before retrying: exponential backoff with full jitter.
+
+    Args:
+        attempt (int): number of the failed attempt (starting at 0)
+        base (float, optional): seconds to wait (at most) after the first failure. Defaults to 2.0.
+        cap (float, optional): max seconds to wait. Defaults to 120.0.
+
+    Returns:
+        float: seconds to wait
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def is_retryable(error: Exception) -> bool:
+    """Returns whether a failed request should be retried (Google returned a 429 or a 5xx)"""
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None) in RETRY_STATUS_CODES
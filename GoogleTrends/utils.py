@@ -1,4 +1,7 @@
 from datetime import datetime, timedelta
+from pathlib import Path
+from urllib.parse import quote
+import numpy as np
 import pandas as pd
 import math
 
@@ -26,6 +29,24 @@ def less_than_gt_range(start_date: datetime, end_date: datetime, freq: str) -> b
         return less_than_270w(start_date, end_date)
 
 
+def get_keyword_batches(kw_list: list, anchor: str, size: int = 5) -> list:
+    """Splits a list of keywords into payloads of at most `size` keywords (pytrends' limit).
+
+    Every payload contains the anchor keyword, so that all payloads can be scaled to each other.
+
+    Args:
+        kw_list (list): list of keywords
+        anchor (str): keyword shared by all payloads
+        size (int, optional): max number of keywords per payload. Defaults to 5.
+
+    Returns:
+        list: list of keyword lists, each starting with the anchor
+    """
+    others = [k for k in kw_list if k != anchor]
+    n = size - 1
+    return [[anchor] + others[i : i + n] for i in range(0, len(others), n)]
+
+
 def get_week_start(d):
     return d - timedelta(days=d.isoweekday() % 7)
 
@@ -45,6 +66,40 @@ def get_start_date(end_date: datetime, freq: str) -> datetime:
         return get_weekly_start_date(end_date)
 
 
+def get_windows(
+    start_date: datetime, end_date: datetime, freq: str, overlap: float = 0.25
+) -> list:
+    """Plans every (start, end) window needed to cover the given date range, newest first.
+
+    Each window spans the maximum range that still returns data at the given granularity (see README),
+    and shares a fixed overlap with the window before it, so all windows can be requested at once.
+    The oldest window is anchored on the start date so it keeps the full span (and the same granularity).
+
+    Args:
+        start_date (datetime): start date of the whole range
+        end_date (datetime): end date of the whole range
+        freq (str): granularity ("daily" or "weekly")
+        overlap (float, optional): share of each window that overlaps the next one. Defaults to 0.25.
+
+    Returns:
+        list: list of (start_date, end_date) tuples
+    """
+    if less_than_gt_range(start_date, end_date, freq):
+        return [(start_date, end_date)]
+    unit = timedelta(days=1) if freq == "daily" else timedelta(weeks=1)
+    span = 269 * unit
+    overlap_td = math.ceil(269 * overlap) * unit
+    windows = []
+    current_end = end_date
+    while not less_than_gt_range(start_date, current_end, freq):
+        current_start = get_start_date(current_end, freq)
+        windows.append((current_start, current_end))
+        current_end = current_start + overlap_td
+    if current_end > start_date:
+        windows.append((start_date, start_date + span))
+    return windows
+
+
 def get_overlapping_date(df: pd.DataFrame, kw_list: list) -> pd.Timestamp:
     """Returns a list of overlapping dates.
 
@@ -75,9 +130,112 @@ def get_overlapping_date(df: pd.DataFrame, kw_list: list) -> pd.Timestamp:
     return df.index[max(max_date_idx, df_shape25)]
 
 
+def stitch(df_list: list, op_date_list: list) -> pd.DataFrame:
+    """Scales a list of overlapping dataframes to each other and merges them into one dataframe, normalized to 100.
+
+    df_list is ordered from the newest to the oldest window, op_date_list[i] is the overlapping date of
+    df_list[i] and df_list[i + 1] (see get_overlapping_date).
+    For each pair of windows, the scale factor of every keyword is the sum of the newer window between its first date and the overlapping date,
+    divided by the sum of the older window over the same dates. Scale factors are multiplied down the list, so each window is scaled
+    to the newest one. The overlapping rows of the older window are dropped, the newer window's values are kept.
+
+    Args:
+        df_list (list): list of raw dataframes, newest first
+        op_date_list (list): list of overlapping dates
+
+    Raises:
+        ValueError: if a keyword has no data in the overlap of two windows, so they can't be scaled
+
+    Returns:
+        pd.DataFrame: scaled dataframe, normalized so that the max value is 100
+    """
+    columns = df_list[0].columns
+    ratios = np.ones((len(df_list), len(columns)))
+    segments = [df_list[0].to_numpy(dtype=float)]
+    index = [df_list[0].index]
+    for i in range(1, len(df_list)):
+        upper, lower = df_list[i - 1], df_list[i]
+        min_date_upper = upper.index.min()
+        numerators = upper.loc[: op_date_list[i - 1], columns].to_numpy().sum(axis=0)
+        denominators = lower.loc[min_date_upper:, columns].to_numpy().sum(axis=0)
+        if not denominators.all():
+            raise ValueError(
+                f"No overlapping data for {list(columns[denominators == 0])} before {op_date_list[i - 1]:%Y-%m-%d}, can't scale the windows."
+            )
+        ratios[i] = numerators / denominators
+        lower = lower.loc[lower.index < min_date_upper, columns]
+        segments.append(lower.to_numpy(dtype=float))
+        index.append(lower.index)
+    factors = np.cumprod(ratios, axis=0)
+    values = np.concatenate([seg * f for seg, f in zip(segments, factors)])
+    values = values / values.max() * 100
+    return pd.DataFrame(
+        values, index=index[0].append(index[1:]), columns=columns
+    ).sort_index()
+
+
+def to_wide(df: pd.DataFrame) -> pd.DataFrame:
+    """Turns the long format of GoogleTrends.get_final_data (one row per date & keyword) back into one column per keyword.
+
+    Args:
+        df (pd.DataFrame): final data, e.g. loaded from a previous run's CSV
+
+    Returns:
+        pd.DataFrame: data indexed by date, one column per keyword
+    """
+    wide = df.pivot(index="date", columns="keyword", values="value")
+    wide.index = pd.to_datetime(wide.index)
+    wide.columns.name = None
+    return wide
+
+
+def constant_column(value, n: int) -> pd.Categorical:
+    """Returns a column of n rows holding the same value, as a categorical (the value is only stored once).
+
+    Args:
+        value: value of every row (None gives an empty column)
+        n (int): number of rows
+
+    Returns:
+        pd.Categorical: column
+    """
+    if value is None:
+        return pd.Categorical.from_codes(np.full(n, -1, dtype="int8"), categories=[])
+    return pd.Categorical.from_codes(np.zeros(n, dtype="int8"), categories=[value])
+
+
 def first_of_month(d: datetime):
     return d.replace(day=1)
 
 
 def get_current_timestamp() -> str:
     return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def write_partitioned(
+    df: pd.DataFrame, output_dir, partition_cols: list, fname: str
+) -> list:
+    """Writes a dataframe as CSV files into a Hive style partitioned folder (e.g. output_dir/client=X/region=US/fname).
+
+    The partition columns are part of the folder names, so they're dropped from the files.
+
+    Args:
+        df (pd.DataFrame): data to write
+        output_dir (str): root folder of the partitioned output
+        partition_cols (list): columns to partition by
+        fname (str): file name inside each partition
+
+    Returns:
+        list: paths of the files written
+    """
+    paths = []
+    for values, part in df.groupby(partition_cols, observed=True):
+        if not isinstance(values, tuple):
+            values = (values,)
+        folder = Path(output_dir).joinpath(
+            *[f"{c}={quote(str(v), safe='')}" for c, v in zip(partition_cols, values)]
+        )
+        folder.mkdir(parents=True, exist_ok=True)
+        part.drop(partition_cols, axis=1).to_csv(folder / fname, index=False)
+        paths.append(folder / fname)
+    return paths
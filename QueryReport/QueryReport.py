@@ -1,10 +1,46 @@
+import time
+from datetime import datetime
 import boto3
-from QueryReport.utils import query_results
+import pandas as pd
+from resultcache import ResultCache, make_key
+from export import EXTENSIONS
+from metrics import RunMetrics
 import config
 
+# pandas dtype of each Athena column type, other types (date, timestamp, decimal, arrays, ...) are read as strings
+ATHENA_DTYPES = {
+    "boolean": "boolean",
+    "tinyint": "Int64",
+    "smallint": "Int64",
+    "integer": "Int64",
+    "bigint": "Int64",
+    "float": "float64",
+    "real": "float64",
+    "double": "float64",
+}
+
 
 class QueryReport:
-    def __init__(self, db_name, channel, site, query):
+    def __init__(
+        self,
+        db_name,
+        channel,
+        site,
+        query,
+        cache_max_age=0,
+        freshness=None,
+        fmt="csv",
+    ):
+        """
+        Args:
+            db_name (str): Athena database name
+            channel (str): channel of the report
+            site (str): site of the report
+            query (str): query to run
+            cache_max_age (int, optional): seconds a previous result of the same query can be reused for (see resultcache.py), 0 disables the cache. Defaults to 0.
+            freshness (str, optional): data freshness marker, results are only reused for the same marker. Defaults to today's date.
+            fmt (str, optional): format of the report file (see export.py). Defaults to "csv".
+        """
         self.db_name = db_name
         self.channel = channel
         self.site = site
@@ -13,6 +49,15 @@ class QueryReport:
         self.aws_path = None
         self.df = None
         self.save_path = None
+        self.fmt = fmt
+        self.execution_id = None
+        self.stats = {}
+        self.cache_max_age = cache_max_age
+        self.freshness = freshness or f"{datetime.now():%Y-%m-%d}"
+        self.cache = None
+        self.cache_key = None
+        self.metrics = RunMetrics(db_name=db_name, channel=channel, site=site, fmt=fmt)
+        self._submitted_at = None
 
     def _create_params(self):
         params = {
@@ -23,17 +68,163 @@ class QueryReport:
             "query": self.query,
         }
         self.params = params
+        if self.cache_max_age:
+            self.cache = ResultCache(
+                self._get_session(),
+                params["bucket"],
+                f"{params['path']}query-cache/",
+                max_age=self.cache_max_age,
+            )
+            self.cache_key = make_key(self.db_name, self.query, self.freshness)
 
-    def get_data(self):
-        self._create_params()
-        session = boto3.Session(
+    def _get_cached(self):
+        """Sets the S3 path of a cached result of this query, if there is one
+
+        Returns:
+            bool: whether a cached result was found
+        """
+        if self.cache is None:
+            return False
+        aws_path = self.cache.get(self.cache_key)
+        if aws_path is None:
+            return False
+        self.aws_path = aws_path
+        self.metrics.record["cache_hit"] = True
+        print("Reusing cached result: ", self.aws_path)
+        return True
+
+    def _read_result(self, **kwargs):
+        bucket, key = self.aws_path.replace("s3://", "").split("/", 1)
+        s3 = self._get_session().client("s3")
+        body = s3.get_object(Bucket=bucket, Key=key)["Body"]
+        return pd.read_csv(body, **kwargs)
+
+    @staticmethod
+    def _get_session():
+        """Returns a boto3 session with the credentials of the config (Athena & S3 calls of every report use them)"""
+        return boto3.Session(
             aws_access_key_id=config.access["id"],
             aws_secret_access_key=config.access["secret"],
             region_name=config.access["region"],
         )
-        self.aws_path, self.df = utils.query_results(session, self.params)
+
+    def get_dtypes(self):
+        """Returns the pandas dtype of each column of the query result, from the column types Athena reports.
+
+        Chunks read with these dtypes all have the same types, whatever values each chunk holds.
+
+        Returns:
+            dict: dtype of each column
+        """
+        # Athena names result files after their query execution ID (also for cached results)
+        execution_id = self.aws_path.rsplit("/", 1)[-1].rsplit(".", 1)[0]
+        athena = self._get_session().client("athena")
+        columns = athena.get_query_results(QueryExecutionId=execution_id, MaxResults=1)[
+            "ResultSet"
+        ]["ResultSetMetadata"]["ColumnInfo"]
+        return {c["Name"]: ATHENA_DTYPES.get(c["Type"].lower(), "string") for c in columns}
+
+    def get_data(self):
+        """Runs the query (unless a cached result is found) and loads its result into self.df"""
+        if self.start_query() is not None:
+            self.wait_for_query()
+        self.load_result()
+
+    def start_query(self):
+        """Submits the query to Athena without waiting for it to finish.
+
+        Nothing is submitted if a cached result of the same query is found (self.aws_path is set instead).
+
+        Returns:
+            str: query execution ID (None if a cached result is reused)
+        """
+        self._create_params()
+        if self._get_cached():
+            return None
+        with self.metrics.span("submit"):
+            athena = self._get_session().client("athena")
+            response = athena.start_query_execution(
+                QueryString=self.params["query"],
+                QueryExecutionContext={"Database": self.params["database"]},
+                ResultConfiguration={
+                    "OutputLocation": f"s3://{self.params['bucket']}/{self.params['path']}"
+                },
+            )
+        self._submitted_at = time.perf_counter()
+        self.execution_id = response["QueryExecutionId"]
+        self.metrics.record["execution_id"] = self.execution_id
+        return self.execution_id
+
+    def wait_for_query(self, poll_interval=2):
+        """Waits for the submitted query to finish and sets the S3 path of its result.
+
+        Args:
+            poll_interval (int, optional): seconds between status checks. Defaults to 2.
+
+        Raises:
+            Exception: if the query failed or was cancelled
+        """
+        athena = self._get_session().client("athena")
+        while True:
+            execution = athena.get_query_execution(QueryExecutionId=self.execution_id)[
+                "QueryExecution"
+            ]
+            state = execution["Status"]["State"]
+            if state == "SUCCEEDED":
+                break
+            if state in ("FAILED", "CANCELLED"):
+                raise Exception(
+                    f"Query {state}: {execution['Status'].get('StateChangeReason')}"
+                )
+            time.sleep(poll_interval)
+        self.set_result(execution)
+
+    def set_result(self, execution):
+        """Sets the S3 path of the result of a finished query (and caches it), and records its Athena statistics
+
+        Args:
+            execution (dict): QueryExecution returned by Athena for this report's query
+        """
+        self.aws_path = execution["ResultConfiguration"]["OutputLocation"]
+        self.stats = execution.get("Statistics", {})
+        self.metrics.set_athena_stats(self.stats)
+        if self._submitted_at is not None:
+            self.metrics.add_span("wait", time.perf_counter() - self._submitted_at)
         print("AWS Data Path: ", self.aws_path)
+        print(f"Data Scanned: {self.stats.get('DataScannedInBytes', 0) / 1024 ** 2:.2f} MB")
+        if self.cache is not None:
+            self.cache.set(self.cache_key, self.aws_path)
+
+    def load_result(self):
+        """Loads the result of a finished (or cached) query into self.df, without running the query again"""
+        with self.metrics.span("fetch"):
+            self.df = self._read_result()
+
+    def iter_data(self, chunksize=100000, dtype=None):
+        """Runs the query and reads its result CSV from S3 in chunks, instead of loading it all into self.df.
+
+        Args:
+            chunksize (int, optional): number of rows per chunk. Defaults to 100000.
+            dtype (dict, optional): dtype of each column. Defaults to None (inferred per chunk), or to get_dtypes for parquet reports,
+                whose chunks must share one schema.
+
+        Yields:
+            pd.DataFrame: chunk of the query result
+        """
+        if self.execution_id is None and self.aws_path is None:
+            self.start_query()
+        if self.aws_path is None:
+            self.wait_for_query()
+        if dtype is None and self.fmt == "parquet":
+            dtype = self.get_dtypes()
+        reader = self._read_result(chunksize=chunksize, dtype=dtype)
+        while True:
+            with self.metrics.span("fetch"):
+                chunk = next(reader, None)
+            if chunk is None:
+                break
+            yield chunk
 
     def get_fname(self, start_date, end_date):
         date_details = f"{start_date:%m-%d-%y}_{end_date:%m-%d-%y}"
-        return f"{self.db_name.capitalize()}_{self.channel}_{self.site}_Data_{date_details}.csv"
+        return f"{self.db_name.capitalize()}_{self.channel}_{self.site}_Data_{date_details}{EXTENSIONS[self.fmt]}"
@@ -0,0 +1,74 @@
+import gzip
+
+EXTENSIONS = {
+    "csv": ".csv",
+    "csv.gz": ".csv.gz",
+    "xlsx": ".xlsx",
+    "parquet": ".parquet",
+}
+
+
+def _write_csv(chunks, f):
+    for i, chunk in enumerate(chunks):
+        f.write(chunk.to_csv(index=False, header=(i == 0)).encode("utf-8"))
+
+
+def _write_xlsx(chunks, f):
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Data")
+    for i, chunk in enumerate(chunks):
+        if i == 0:
+            ws.append(list(chunk.columns))
+        chunk = chunk.astype(object).where(chunk.notna(), None)
+        for row in chunk.itertuples(index=False):
+            ws.append(list(row))
+    wb.save(f)
+
+
+def _write_parquet(chunks, f):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    for chunk in chunks:
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(f, table.schema, compression="snappy")
+        elif not table.schema.equals(writer.schema):
+            table = table.cast(writer.schema)
+        writer.write_table(table)
+    if writer is not None:
+        writer.close()
+
+
+def write_chunks(chunks, f, fmt="csv"):
+    """Writes dataframe chunks into a binary file, one chunk at a time.
+
+    Formats:
+    - csv: uncompressed CSV
+    - csv.gz: gzip compressed CSV
+    - xlsx: Excel workbook, for business users (max 1,048,576 rows, needs openpyxl)
+    - parquet: Parquet file, one row group per chunk, for downstream tooling (needs pyarrow).
+      Chunks should be read with explicit dtypes (see QueryReport.get_dtypes), chunks whose types differ are cast to the first chunk's schema.
+
+    Args:
+        chunks (iterable): dataframes with the same columns
+        f (file): binary file to write into
+        fmt (str, optional): format (see EXTENSIONS). Defaults to "csv".
+
+    Raises:
+        ValueError: if the format isn't supported
+    """
+    if fmt == "csv":
+        _write_csv(chunks, f)
+    elif fmt == "csv.gz":
+        with gzip.GzipFile(fileobj=f, mode="wb") as gz:
+            _write_csv(chunks, gz)
+    elif fmt == "xlsx":
+        _write_xlsx(chunks, f)
+    elif fmt == "parquet":
+        _write_parquet(chunks, f)
+    else:
+        raise ValueError(f"Unsupported format: {fmt} (supported: {list(EXTENSIONS)})")
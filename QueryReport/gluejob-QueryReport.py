@@ -1,36 +1,107 @@
 from QueryReport import QueryReport
+from sharepoint import SharePointUploader
+from queryconfig import QueryConfigProvider, LocalBackend
+from template import render_query
+from export import write_chunks
 import utils
 import boto3
+import os
 import sys
+import time
+import tempfile
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from awsglue.utils import getResolvedOptions
 import config
-import sharepy
 
-args = getResolvedOptions(sys.argv, ["QueryID", "Channel"])
-query_id = args["QueryID"]
-db_name = query_id.split("-")[0]
+def get_optional_arg(name, default=None):
+    """Returns an optional job argument (getResolvedOptions fails on missing arguments)"""
+    if f"--{name}" in sys.argv:
+        return getResolvedOptions(sys.argv, [name])[name]
+    return default
+
+
+args = getResolvedOptions(sys.argv, ["Channel"])
 channel = args["Channel"]
+query_ids = get_optional_arg("QueryIDs")
+if query_ids is None:
+    query_id = getResolvedOptions(sys.argv, ["QueryID"])["QueryID"]
+    db_name = query_id.split("-")[0]
+else:
+    query_ids = [q.strip() for q in query_ids.split(",") if q.strip()]
+stream = get_optional_arg("Stream", "false").lower() == "true"
+cache_max_age = int(get_optional_arg("CacheMaxAge", "0")) * 60
+freshness = get_optional_arg("Freshness")
+uploader = SharePointUploader()
+config_file = get_optional_arg("ConfigFile")
+config_provider = QueryConfigProvider(LocalBackend(config_file) if config_file else None)
+metrics_path = get_optional_arg(
+    "MetricsPath", f"s3://{config.access['bucket']}/{config.access['path']}metrics/"
+)
+
+
+def get_date_window():
+    """Returns the date window of the report from the job arguments (--DaysBack, or --StartDate & --EndDate)
+
+    Returns:
+        start_date (datetime): start date (None if no window was given)
+        end_date (datetime): end date (None if no window was given)
+    """
+    days_back = get_optional_arg("DaysBack")
+    if days_back is not None:
+        end_date = datetime.now() - timedelta(days=1)
+        return end_date - timedelta(days=int(days_back) - 1), end_date
+    start_date, end_date = get_optional_arg("StartDate"), get_optional_arg("EndDate")
+    if start_date is None or end_date is None:
+        return None, None
+    return datetime.strptime(start_date, "%Y-%m-%d"), datetime.strptime(end_date, "%Y-%m-%d")
+
+
+start_date, end_date = get_date_window()
 
 
 def get_query(query_id):
-    """Fetches query from AWS dynamoDB
+    """Fetches query from the query configs (see queryconfig.py)
 
     Args:
         query_id (str): query ID
 
+    Query templates are filled in with the date window & partition columns of the config (see template.py).
+
     Returns:
-        query (str): query from dynamoDB
+        query (str): query
     """
-    dyndb_client = boto3.client("dynamodb", region_name=config.access["region"])
-    response = dyndb_client.get_item(
-        TableName="dyndb-config-query", Key={"QueryID": {"S": query_id}}
-    )
-    if "Item" in response:
-        return response["Item"]["Query"]["S"]
-    else:
+    try:
+        item = config_provider.get(query_id)
+    except KeyError:
         print("No config settings")
         sys.exit()
+    return render_query(
+        item["Query"], start_date, end_date, item.get("PartitionColumns")
+    )
+
+
+def get_queries(query_ids):
+    """Fetches the queries of several query IDs at once (see queryconfig.py)
+
+    Args:
+        query_ids (list): query IDs
+
+    Returns:
+        queries (dict): query of each query ID found
+    """
+    config_provider.load(query_ids)
+    queries = {}
+    for q in query_ids:
+        try:
+            item = config_provider.get(q)
+        except KeyError:
+            continue
+        queries[q] = render_query(
+            item["Query"], start_date, end_date, item.get("PartitionColumns")
+        )
+    return queries
 
 
 def get_date_details(df, datecol):
@@ -39,34 +110,227 @@ def get_date_details(df, datecol):
     return tdf[datecol].min(), tdf[datecol].max()
 
 
-def to_sharepoint(df, sp_folder, filename):
-    s = sharepy.connect(
-        config.sharepoint["baseURL"],
-        username=config.sharepoint["username"],
-        password=config.sharepoint["password"],
-    )
-    url = config.sharepoint["URL"].format(folder=sp_folder, fname=filename)
-    data = utils.export_csv(df)
-    r = s.post(url, data=data, headers={"content-length": str(len(data))})
+def get_format(query_id):
+    """Returns the format of a report file, from the Format attribute of its config (see export.py)"""
+    return config_provider.get(query_id).get("Format", "csv")
+
+
+def stream_report(report, site, datecol):
+    """Writes the query result into a temporary file chunk by chunk, so it's never fully loaded in memory.
+
+    Columns are reordered per chunk, and the min & max dates are tracked while reading.
+    The file is written in the report's format (see export.py).
+
+    Args:
+        report (QueryReport): report with a query to run
+        site (str): site of the report (see utils.reorder_cols)
+        datecol (str): name of the date column
+
+    Returns:
+        spool (file): temporary file holding the report, at position 0
+        sdate (pd.Timestamp): min date
+        edate (pd.Timestamp): max date
+    """
+    spool = tempfile.TemporaryFile()
+    dates = {"min": None, "max": None}
+
+    def chunks():
+        for chunk in report.iter_data():
+            chunk = utils.reorder_cols(chunk, site)
+            chunk_dates = pd.to_datetime(chunk[datecol])
+            if dates["min"] is None:
+                dates["min"], dates["max"] = chunk_dates.min(), chunk_dates.max()
+            else:
+                dates["min"] = min(dates["min"], chunk_dates.min())
+                dates["max"] = max(dates["max"], chunk_dates.max())
+            yield chunk
+
+    write_chunks(chunks(), spool, report.fmt)
+    spool.seek(0)
+    return spool, dates["min"], dates["max"]
+
+
+def to_sharepoint(data, sp_folder, filename, fmt="csv"):
+    """Sends a report to SharePoint
+
+    Args:
+        data (pd.DataFrame or file): report, or temporary file holding the report (see stream_report)
+        sp_folder (str): SharePoint folder
+        filename (str): file name
+        fmt (str, optional): format of the file, if the report is a dataframe (see export.py). Defaults to "csv".
+
+    Returns:
+        size (int): size of the uploaded file
+    """
+    if isinstance(data, pd.DataFrame) and fmt != "csv":
+        with tempfile.TemporaryFile() as f:
+            write_chunks([data], f, fmt)
+            f.seek(0)
+            return to_sharepoint(f, sp_folder, filename)
+    if isinstance(data, pd.DataFrame):
+        data = utils.export_csv(data)
+    size = os.fstat(data.fileno()).st_size if hasattr(data, "fileno") else len(data)
+    r = uploader.upload(sp_folder, filename, data)
     print(r)
     print(r.content)
+    return size
+
+
+def publish_report(report):
+    """Gets the data of a report and sends it to SharePoint.
+
+    If the report's query already finished (or a cached result was found), its result is read instead of running the query again.
+    The run metrics of the report (see metrics.py) are written whether it succeeded or not.
+
+    Args:
+        report (QueryReport): report to publish
+    """
+    try:
+        sp_folder = utils.get_sp_folder(report.channel, report.site)
+        print(sp_folder)
+        if stream:
+            with report.metrics.span("fetch_and_write"):
+                spool, sdate, edate = stream_report(report, report.site, "Date")
+            fname = report.get_fname(sdate, edate)
+            with spool, report.metrics.span("upload"):
+                size = to_sharepoint(spool, sp_folder, fname)
+        else:
+            if report.aws_path is None:
+                report.get_data()
+            else:
+                report.load_result()
+            print(report.df.columns)
+            df = utils.reorder_cols(report.df, report.site)
+            sdate, edate = get_date_details(report.df, "Date")
+            fname = report.get_fname(sdate, edate)
+            with report.metrics.span("upload"):
+                size = to_sharepoint(df, sp_folder, fname, report.fmt)
+        report.metrics.record["bytes_uploaded"] = size
+        report.metrics.record["status"] = "succeeded"
+    except Exception as e:
+        report.metrics.record["status"] = "failed"
+        report.metrics.record["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        write_metrics(report)
+
+
+def write_metrics(report):
+    """Writes the run metrics of a report to --MetricsPath (see metrics.py), a failure to write them doesn't fail the report"""
+    try:
+        report.metrics.write(metrics_path, report._get_session())
+    except Exception as e:
+        print(f"Could not write metrics: {type(e).__name__}: {e}")
+
+
+def record_failure(report, error):
+    """Marks a report's run as failed and writes its metrics"""
+    report.metrics.record["status"] = "failed"
+    report.metrics.record["error"] = error
+    write_metrics(report)
+
+
+def run_batch(query_ids, poll_interval=5, max_workers=8):
+    """Runs several reports concurrently.
+
+    The queries are fetched with one dynamoDB batch read, all Athena executions are submitted at once and polled together.
+    Each report is sent to SharePoint (in a thread pool) as soon as its query finishes,
+    so the job takes about as long as the slowest report.
+
+    Args:
+        query_ids (list): query IDs
+        poll_interval (int, optional): seconds between status checks. Defaults to 5.
+        max_workers (int, optional): number of reports sent to SharePoint at the same time. Defaults to 8.
+
+    A report whose query can't be submitted (e.g. throttling, invalid query) is recorded as failed, the others still run.
+
+    Raises:
+        Exception: if any report failed, once every other report is done
+    """
+    queries = get_queries(query_ids)
+    failures = {q: "No config settings" for q in query_ids if q not in queries}
+    reports = {}
+    for qid, query in queries.items():
+        site = config_provider.get_site(qid)
+        print(f"QueryID: {qid}\nSite: {site}\nQuery:\n{query}")
+        reports[qid] = QueryReport(
+            qid.split("-")[0],
+            channel,
+            site,
+            query,
+            cache_max_age,
+            freshness,
+            get_format(qid),
+        )
+        reports[qid].metrics.record["query_id"] = qid
+        try:
+            reports[qid].start_query()
+        except Exception as e:
+            failures[qid] = f"{type(e).__name__}: {e}"
+            record_failure(reports.pop(qid), failures[qid])
+
+    # same credentials as the ones the queries were submitted with
+    athena = QueryReport._get_session().client("athena")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            qid: executor.submit(publish_report, r)
+            for qid, r in reports.items()
+            if r.aws_path is not None
+        }
+        pending = {
+            r.execution_id: qid for qid, r in reports.items() if r.aws_path is None
+        }
+        while pending:
+            execution_ids = list(pending)
+            for i in range(0, len(execution_ids), 50):
+                response = athena.batch_get_query_execution(
+                    QueryExecutionIds=execution_ids[i : i + 50]
+                )
+                for execution in response["QueryExecutions"]:
+                    state = execution["Status"]["State"]
+                    if state == "SUCCEEDED":
+                        qid = pending.pop(execution["QueryExecutionId"])
+                        reports[qid].set_result(execution)
+                        futures[qid] = executor.submit(publish_report, reports[qid])
+                    elif state in ("FAILED", "CANCELLED"):
+                        qid = pending.pop(execution["QueryExecutionId"])
+                        failures[qid] = f"Query {state}: {execution['Status'].get('StateChangeReason')}"
+                        reports[qid].metrics.set_athena_stats(execution.get("Statistics", {}))
+                        record_failure(reports[qid], failures[qid])
+            if pending:
+                time.sleep(poll_interval)
+
+        for qid, future in futures.items():
+            try:
+                future.result()
+                print(f"Done: {qid}")
+            except Exception as e:
+                failures[qid] = f"{type(e).__name__}: {e}"
+
+    if failures:
+        raise Exception(f"{len(failures)} of {len(query_ids)} reports failed: {failures}")
 
 
 if __name__ == "__main__":
 
-    site = utils.get_site(query_id)
-    query = get_query(query_id)
-
-    print(f"QueryID: {query_id}")
-    print(f"Site: {site}")
-    print(f"Query:\n{query}")
-
-    report = QueryReport(db_name, channel, site, query)
-    report.get_data()
-    print(report.df.columns)
-    df = utils.reorder_cols(report.df, site)
-    sdate, edate = get_date_details(report.df, "Date")
-    fname = report.get_fname(sdate, edate)
-    sp_folder = utils.get_sp_folder(channel, site)
-    print(sp_folder)
-    to_sharepoint(df, sp_folder, fname)
+    if query_ids is not None:
+        run_batch(query_ids)
+    else:
+        query = get_query(query_id)
+        site = config_provider.get_site(query_id)
+
+        print(f"QueryID: {query_id}")
+        print(f"Site: {site}")
+        print(f"Query:\n{query}")
+
+        report = QueryReport(
+            db_name,
+            channel,
+            site,
+            query,
+            cache_max_age,
+            freshness,
+            get_format(query_id),
+        )
+        report.metrics.record["query_id"] = query_id
+        publish_report(report)
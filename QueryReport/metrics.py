@@ -0,0 +1,126 @@
+import json
+import time
+from contextlib import contextmanager
+from datetime import datetime
+import boto3
+import pandas as pd
+
+ATHENA_STATS = [
+    "QueryQueueTimeInMillis",
+    "QueryPlanningTimeInMillis",
+    "EngineExecutionTimeInMillis",
+    "ServiceProcessingTimeInMillis",
+    "TotalExecutionTimeInMillis",
+    "DataScannedInBytes",
+]
+
+
+class RunMetrics:
+    """Timing spans & Athena statistics of one report run, written as one JSON line.
+
+    Spans are recorded in seconds, a span recorded several times (e.g. fetching each chunk) is summed up.
+    """
+
+    def __init__(self, **details):
+        self.record = {
+            "run_timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            **details,
+            "status": "running",
+            "spans": {},
+            "athena": {},
+        }
+
+    def add_span(self, name, seconds):
+        spans = self.record["spans"]
+        spans[name] = spans.get(name, 0.0) + seconds
+
+    @contextmanager
+    def span(self, name):
+        """Records the time spent in a with block as a span"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_span(name, time.perf_counter() - start)
+
+    def set_athena_stats(self, stats):
+        """Saves the engine statistics of a finished Athena query execution
+
+        Args:
+            stats (dict): Statistics of the QueryExecution returned by Athena
+        """
+        self.record["athena"] = {k: stats[k] for k in ATHENA_STATS if k in stats}
+
+    def to_json(self):
+        record = {**self.record, "spans": {k: round(v, 3) for k, v in self.record["spans"].items()}}
+        return json.dumps(record, default=str)
+
+    def write(self, path, session=None):
+        """Writes the run as a JSON line
+
+        Args:
+            path (str): local file to append the line to, or S3 prefix (s3://bucket/prefix/) to save the line into its own object
+            session (boto3.Session, optional): session to write to S3 with (e.g. QueryReport._get_session()). Defaults to the default credentials.
+        """
+        line = self.to_json()
+        print(f"Run metrics: {line}")
+        if path.startswith("s3://"):
+            bucket, prefix = path.replace("s3://", "").split("/", 1)
+            key = f"{prefix}{self.record.get('query_id', 'report')}/{datetime.now():%Y%m%d_%H%M%S_%f}.json"
+            (session or boto3.Session()).client("s3").put_object(Bucket=bucket, Key=key, Body=line + "\n")
+        else:
+            with open(path, "a") as f:
+                f.write(line + "\n")
+
+
+def load(path, session=None):
+    """Loads the runs written by RunMetrics.write
+
+    Args:
+        path (str): local JSON lines file, or S3 prefix
+        session (boto3.Session, optional): session to read S3 with. Defaults to the default credentials.
+
+    Returns:
+        list: run records
+    """
+    if not path.startswith("s3://"):
+        with open(path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    bucket, prefix = path.replace("s3://", "").split("/", 1)
+    s3 = (session or boto3.Session()).client("s3")
+    records = []
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            body = s3.get_object(Bucket=bucket, Key=obj["Key"])["Body"].read()
+            records.extend(json.loads(line) for line in body.decode("utf-8").splitlines() if line.strip())
+    return records
+
+
+def summarize(records):
+    """Summarizes runs per query ID: number of runs, failures, and the mean & max of every span and Athena statistic
+
+    Args:
+        records (list): run records (see load)
+
+    Returns:
+        pd.DataFrame: one row per query ID, slowest reports first
+    """
+    df = pd.json_normalize(records)
+    df["failed"] = df["status"] == "failed"
+    metric_cols = [c for c in df.columns if c.startswith(("spans.", "athena."))]
+    summary = df.groupby("query_id").agg(
+        runs=("status", "size"),
+        failures=("failed", "sum"),
+        **{f"{c}_mean": (c, "mean") for c in metric_cols},
+        **{f"{c}_max": (c, "max") for c in metric_cols},
+    )
+    sort_col = "athena.TotalExecutionTimeInMillis_mean"
+    if sort_col in summary:
+        summary = summary.sort_values(sort_col, ascending=False)
+    return summary
+
+
+if __name__ == "__main__":
+    import sys
+
+    print(summarize(load(sys.argv[1])).to_string())
@@ -0,0 +1,198 @@
+import json
+import time
+import boto3
+from boto3.dynamodb.types import TypeDeserializer
+import config
+import utils
+
+TABLE_NAME = "dyndb-config-query"
+
+
+class DynamoDBBackend:
+    """Reads query configs from the DynamoDB config table, in bulk"""
+
+    def __init__(self, table=TABLE_NAME, region=None):
+        self.table = table
+        self.client = boto3.client(
+            "dynamodb", region_name=region or config.access["region"]
+        )
+        self._deserializer = TypeDeserializer()
+
+    def _to_dict(self, item):
+        return {k: self._deserializer.deserialize(v) for k, v in item.items()}
+
+    def batch_get(self, query_ids, attributes=None):
+        """Returns the items of the given query IDs (batch reads of 100 keys)
+
+        Args:
+            query_ids (list): query IDs
+            attributes (list, optional): attributes to read. Defaults to None (all).
+
+        Returns:
+            dict: item of each query ID found
+        """
+        items = {}
+        for i in range(0, len(query_ids), 100):
+            keys = {"Keys": [{"QueryID": {"S": q}} for q in query_ids[i : i + 100]]}
+            if attributes:
+                keys["ProjectionExpression"] = ", ".join(f"#a{j}" for j in range(len(attributes)))
+                keys["ExpressionAttributeNames"] = {f"#a{j}": a for j, a in enumerate(attributes)}
+            request = {self.table: keys}
+            while request:
+                response = self.client.batch_get_item(RequestItems=request)
+                for item in response["Responses"].get(self.table, []):
+                    item = self._to_dict(item)
+                    items[item["QueryID"]] = item
+                request = response.get("UnprocessedKeys")
+                if request:
+                    time.sleep(1)
+        return items
+
+    def scan(self, prefix=""):
+        """Returns the items of every query ID starting with the given prefix
+
+        Args:
+            prefix (str, optional): query ID prefix (e.g. a database name). Defaults to "" (all).
+
+        Returns:
+            dict: item of each query ID found
+        """
+        items = {}
+        kwargs = {"TableName": self.table}
+        if prefix:
+            kwargs["FilterExpression"] = "begins_with(QueryID, :prefix)"
+            kwargs["ExpressionAttributeValues"] = {":prefix": {"S": prefix}}
+        for page in self.client.get_paginator("scan").paginate(**kwargs):
+            for item in page["Items"]:
+                item = self._to_dict(item)
+                items[item["QueryID"]] = item
+        return items
+
+
+class LocalBackend:
+    """Local stand-in for DynamoDBBackend, reading query configs from a dict or a JSON file ({query_id: item}), to test offline"""
+
+    def __init__(self, items):
+        if isinstance(items, str):
+            with open(items) as f:
+                items = json.load(f)
+        self.items = {q: {"QueryID": q, **item} for q, item in items.items()}
+
+    def batch_get(self, query_ids, attributes=None):
+        items = {q: self.items[q] for q in query_ids if q in self.items}
+        if attributes:
+            items = {q: {a: item[a] for a in attributes if a in item} for q, item in items.items()}
+        return items
+
+    def scan(self, prefix=""):
+        return {q: item for q, item in self.items.items() if q.startswith(prefix)}
+
+
+class QueryConfigProvider:
+    """Serves query configs from memory, loading them in bulk from a backend.
+
+    - Configs are loaded with one batch read (load) or a scan by query ID prefix (load_prefix), then served from memory.
+    - After `ttl` seconds, a config is checked again before being served: if it has a Version attribute,
+      only the versions are read, and configs are only reloaded if their version changed.
+    - If a `cache_path` is given, the cache is also saved into / loaded from that local JSON file, so it's kept across runs.
+    """
+
+    def __init__(self, backend=None, ttl=15 * 60, cache_path=None):
+        self.backend = backend or DynamoDBBackend()
+        self.ttl = ttl
+        self.cache_path = cache_path
+        self._cache = {}
+        if cache_path:
+            try:
+                with open(cache_path) as f:
+                    self._cache = json.load(f)
+            except (FileNotFoundError, ValueError):
+                pass
+
+    def _save(self):
+        if self.cache_path:
+            with open(self.cache_path, "w") as f:
+                json.dump(self._cache, f, default=str)
+
+    def _store(self, items):
+        now = time.time()
+        for query_id, item in items.items():
+            self._cache[query_id] = {"item": item, "fetched_at": now}
+
+    @staticmethod
+    def _version(item):
+        # DynamoDB returns numbers as Decimal, the cache file stores them as strings
+        return None if item.get("Version") is None else str(item["Version"])
+
+    def _refresh(self, query_ids):
+        """Reloads the given configs, skipping the ones whose version didn't change and dropping the deleted ones"""
+        versioned = [q for q in query_ids if "Version" in self._cache.get(q, {}).get("item", {})]
+        unchanged = []
+        if versioned:
+            versions = self.backend.batch_get(versioned, attributes=["QueryID", "Version"])
+            unchanged = [
+                q for q in versioned
+                if q in versions and self._version(versions[q]) == self._version(self._cache[q]["item"])
+            ]
+            now = time.time()
+            for q in unchanged:
+                self._cache[q]["fetched_at"] = now
+        to_load = [q for q in query_ids if q not in unchanged]
+        if to_load:
+            items = self.backend.batch_get(to_load)
+            for q in to_load:
+                if q not in items:
+                    self._cache.pop(q, None)
+            self._store(items)
+
+    def load(self, query_ids):
+        """Loads the configs of several query IDs at once (only the missing or expired ones)
+
+        Args:
+            query_ids (list): query IDs
+        """
+        now = time.time()
+        missing = [q for q in query_ids if q not in self._cache]
+        expired = [
+            q for q in query_ids
+            if q in self._cache and now - self._cache[q]["fetched_at"] > self.ttl
+        ]
+        if missing:
+            self._store(self.backend.batch_get(missing))
+        if expired:
+            self._refresh(expired)
+        if missing or expired:
+            self._save()
+
+    def load_prefix(self, prefix=""):
+        """Loads the configs of every query ID starting with the given prefix
+
+        Args:
+            prefix (str, optional): query ID prefix (e.g. a database name). Defaults to "" (all).
+        """
+        self._store(self.backend.scan(prefix))
+        self._save()
+
+    def get(self, query_id):
+        """Returns the config of a query ID
+
+        Args:
+            query_id (str): query ID
+
+        Raises:
+            KeyError: if there's no config for the query ID
+
+        Returns:
+            dict: config item
+        """
+        self.load([query_id])
+        if query_id not in self._cache:
+            raise KeyError(f"No config settings for {query_id}")
+        return self._cache[query_id]["item"]
+
+    def get_query(self, query_id):
+        return self.get(query_id)["Query"]
+
+    def get_site(self, query_id):
+        """Returns the site of a query ID, from its config (Site attribute) or from utils.get_site"""
+        return self.get(query_id).get("Site") or utils.get_site(query_id)
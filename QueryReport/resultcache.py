@@ -0,0 +1,92 @@
+import hashlib
+import json
+import re
+import time
+from botocore.exceptions import ClientError
+
+
+def normalize_query(query):
+    """Collapses whitespace and drops the trailing semicolon, so formatting changes don't change the cache key"""
+    return re.sub(r"\s+", " ", query).strip().rstrip(";").strip()
+
+
+def make_key(database, query, freshness):
+    """Returns the cache key of a query
+
+    Args:
+        database (str): database name
+        query (str): query
+        freshness (str): data freshness marker (e.g. date of the last data load), results are only reused for the same marker
+
+    Returns:
+        str: cache key
+    """
+    raw = json.dumps([database, normalize_query(query), freshness])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """Index of previous Athena results, so the same query doesn't scan the same data again.
+
+    Each entry is a small JSON object in S3 (s3://bucket/prefix/<key>.json) pointing to the result CSV Athena already saved.
+    - Entries older than `max_age` seconds are evicted when they're looked up (or by evict_expired).
+    - Entries whose result CSV was deleted are evicted too.
+    """
+
+    def __init__(self, session, bucket, prefix, max_age=24 * 60 * 60):
+        self.s3 = session.client("s3")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.max_age = max_age
+
+    def _entry_key(self, key):
+        return f"{self.prefix}{key}.json"
+
+    def _result_exists(self, aws_path):
+        bucket, key = aws_path.replace("s3://", "").split("/", 1)
+        try:
+            self.s3.head_object(Bucket=bucket, Key=key)
+            return True
+        except ClientError:
+            return False
+
+    def get(self, key):
+        """Returns the S3 path of a cached result
+
+        Args:
+            key (str): cache key (see make_key)
+
+        Returns:
+            str: S3 path of the result CSV (None if it's not cached, expired or deleted)
+        """
+        try:
+            obj = self.s3.get_object(Bucket=self.bucket, Key=self._entry_key(key))
+        except ClientError:
+            return None
+        entry = json.loads(obj["Body"].read())
+        if time.time() - entry["created"] > self.max_age or not self._result_exists(
+            entry["aws_path"]
+        ):
+            self.s3.delete_object(Bucket=self.bucket, Key=self._entry_key(key))
+            return None
+        return entry["aws_path"]
+
+    def set(self, key, aws_path):
+        """Saves the S3 path of a query result
+
+        Args:
+            key (str): cache key (see make_key)
+            aws_path (str): S3 path of the result CSV
+        """
+        entry = {"aws_path": aws_path, "created": time.time()}
+        self.s3.put_object(
+            Bucket=self.bucket, Key=self._entry_key(key), Body=json.dumps(entry)
+        )
+
+    def evict_expired(self):
+        """Deletes every entry older than max_age"""
+        paginator = self.s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for obj in page.get("Contents", []):
+                if time.time() - obj["LastModified"].timestamp() > self.max_age:
+                    self.s3.delete_object(Bucket=self.bucket, Key=obj["Key"])
@@ -0,0 +1,150 @@
+import tempfile
+import threading
+import time
+import uuid
+import sharepy
+import config
+
+
+class SharePointUploader:
+    """Uploads files to SharePoint, reusing authenticated sessions for the whole job.
+
+    Each upload thread gets its own session (requests sessions aren't thread safe), kept for every upload of that thread.
+    Files up to `chunk_size` bytes are posted in one request (config.sharepoint["URL"]).
+    Bigger files are uploaded in chunks through an upload session on the file (config.sharepoint["fileURL"]):
+    StartUpload with the first chunk, ContinueUpload for the next ones and FinishUpload with the last one.
+    A chunk that fails is retried on its own (up to `max_retries` times), the chunks already uploaded are kept.
+    Without a "fileURL" in the config, bigger files are posted in one request too, streamed from a file.
+
+    A session factory (e.g. requests.Session) and URLs can be given instead of the config, to test against a local HTTP stand-in.
+    """
+
+    def __init__(
+        self,
+        session_factory=None,
+        chunk_size=10 * 1024 ** 2,
+        max_retries=3,
+        add_url=None,
+        file_url=None,
+    ):
+        self.session_factory = session_factory or self._connect
+        self._local = threading.local()
+        self.chunk_size = chunk_size
+        self.max_retries = max_retries
+        self.add_url = add_url or config.sharepoint["URL"]
+        self.file_url = file_url or config.sharepoint.get("fileURL")
+
+    @staticmethod
+    def _connect():
+        return sharepy.connect(
+            config.sharepoint["baseURL"],
+            username=config.sharepoint["username"],
+            password=config.sharepoint["password"],
+        )
+
+    @property
+    def session(self):
+        if getattr(self._local, "session", None) is None:
+            self._local.session = self.session_factory()
+        return self._local.session
+
+    def _post(self, url, data, size=None):
+        """Posts bytes, or a file object (streamed from its current position, size bytes)"""
+        start = data.tell() if hasattr(data, "read") else None
+        for attempt in range(self.max_retries + 1):
+            try:
+                if start is not None:
+                    data.seek(start)
+                r = self.session.post(
+                    url,
+                    data=data,
+                    headers={"content-length": str(len(data) if size is None else size)},
+                )
+                r.raise_for_status()
+                return r
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                print(f"SharePoint request failed ({e}), retrying.")
+                time.sleep(2 ** attempt)
+
+    def _iter_chunks(self, data):
+        """Splits a string, bytes, file object or iterable of bytes into chunks of chunk_size bytes"""
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        if isinstance(data, bytes):
+            data = [data]
+        elif hasattr(data, "read"):
+            f = data
+            data = iter(lambda: f.read(self.chunk_size), b"")
+        buffer = bytearray()
+        for piece in data:
+            buffer.extend(piece.encode("utf-8") if isinstance(piece, str) else piece)
+            while len(buffer) >= self.chunk_size:
+                yield bytes(buffer[: self.chunk_size])
+                del buffer[: self.chunk_size]
+        if buffer:
+            yield bytes(buffer)
+
+    def _post_file(self, url, data):
+        """Posts a whole file in one request, without loading it in memory.
+
+        File objects are streamed as they are, iterables of bytes are spooled into a temporary file first.
+        """
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        if isinstance(data, bytes):
+            return self._post(url, data)
+        if hasattr(data, "read"):
+            start = data.tell()
+            size = data.seek(0, 2) - start
+            data.seek(start)
+            return self._post(url, data, size)
+        with tempfile.TemporaryFile() as f:
+            for chunk in self._iter_chunks(data):
+                f.write(chunk)
+            size = f.tell()
+            f.seek(0)
+            return self._post(url, f, size)
+
+    def upload(self, sp_folder, filename, data):
+        """Uploads a file into a SharePoint folder (overwriting it)
+
+        Args:
+            sp_folder (str): SharePoint folder
+            filename (str): file name
+            data (str, bytes, file or iterable of bytes): content of the file, read chunk by chunk
+
+        Returns:
+            requests.Response: response of the last request
+        """
+        add_url = self.add_url.format(folder=sp_folder, fname=filename)
+        if self.file_url is None:
+            return self._post_file(add_url, data)
+        chunks = self._iter_chunks(data)
+        first = next(chunks, b"")
+        second = next(chunks, None)
+        if second is None:
+            return self._post(add_url, first)
+
+        file_url = self.file_url.format(folder=sp_folder, fname=filename)
+        upload_id = uuid.uuid4()
+        self._post(add_url, b"")
+        try:
+            self._post(f"{file_url}/StartUpload(uploadId=guid'{upload_id}')", first)
+            offset = len(first)
+            chunk = second
+            for next_chunk in chunks:
+                self._post(
+                    f"{file_url}/ContinueUpload(uploadId=guid'{upload_id}',fileOffset={offset})",
+                    chunk,
+                )
+                offset += len(chunk)
+                chunk = next_chunk
+            return self._post(
+                f"{file_url}/FinishUpload(uploadId=guid'{upload_id}',fileOffset={offset})",
+                chunk,
+            )
+        except Exception:
+            self.session.post(f"{file_url}/CancelUpload(uploadId=guid'{upload_id}')")
+            raise
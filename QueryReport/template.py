@@ -0,0 +1,73 @@
+import re
+from datetime import timedelta
+
+# $name or ${name}, any other $ of the query is left as it is
+PLACEHOLDERS = re.compile(
+    r"\$(?:\{(start_date|end_date|partition_filter)\}|(start_date|end_date|partition_filter)\b)"
+)
+
+
+def partition_filter(start_date, end_date, partition_columns):
+    """Builds a predicate selecting the partitions of a date window, so Athena only scans those partitions.
+
+    - One partition column (e.g. {"dt": "%Y-%m-%d"}): dt BETWEEN '<start>' AND '<end>'.
+      Partition values are compared as strings, so this only works for date formats that sort like dates (e.g. %Y-%m-%d or %Y%m%d,
+      not %d-%m-%Y).
+    - Several partition columns (e.g. {"year": "%Y", "month": "%m", "day": "%d"}): one condition per partition in the window,
+      (year = '2022' AND month = '01' AND day = '01') OR ...
+
+    Args:
+        start_date (datetime): start date of the window
+        end_date (datetime): end date of the window
+        partition_columns (dict): date format of each partition column
+
+    Returns:
+        str: SQL predicate
+    """
+    if len(partition_columns) == 1:
+        col, fmt = next(iter(partition_columns.items()))
+        return f"{col} BETWEEN '{start_date:{fmt}}' AND '{end_date:{fmt}}'"
+    partitions = []
+    d = start_date
+    while d <= end_date:
+        values = tuple(f"{d:{fmt}}" for fmt in partition_columns.values())
+        if values not in partitions:
+            partitions.append(values)
+        d += timedelta(days=1)
+    conditions = [
+        "(" + " AND ".join(f"{col} = '{v}'" for col, v in zip(partition_columns, values)) + ")"
+        for values in partitions
+    ]
+    return "(" + " OR ".join(conditions) + ")"
+
+
+def render_query(query, start_date=None, end_date=None, partition_columns=None):
+    """Fills in a query template with a date window.
+
+    Templates can use ${start_date} & ${end_date} (format: %Y-%m-%d) and ${partition_filter} (see partition_filter, TRUE if the
+    config has no partition columns). Only these placeholders are replaced, any other $ (e.g. $$) is left as it is.
+
+    Args:
+        query (str): query template
+        start_date (datetime, optional): start date of the window. Defaults to None.
+        end_date (datetime, optional): end date of the window. Defaults to None.
+        partition_columns (dict, optional): date format of each partition column. Defaults to None.
+
+    Raises:
+        ValueError: if the query is a template but no date window was given
+
+    Returns:
+        str: query
+    """
+    if start_date is None or end_date is None:
+        if PLACEHOLDERS.search(query):
+            raise ValueError("The query is a template, a date window is needed to fill it in.")
+        return query
+    values = {
+        "start_date": f"{start_date:%Y-%m-%d}",
+        "end_date": f"{end_date:%Y-%m-%d}",
+        "partition_filter": partition_filter(start_date, end_date, partition_columns)
+        if partition_columns
+        else "TRUE",
+    }
+    return PLACEHOLDERS.sub(lambda m: values[m.group(1) or m.group(2)], query)
@@ -1,6 +1,5 @@
 import io
 import re
-import requests
 import pandas as pd
 import boto3
 from datetime import datetime, timedelta
@@ -10,10 +9,14 @@ from config import delty
 import sys
 import utils
 from utils import JobError
+from httpclient import HTTPClient
 
 class Delty:
     """ Class for representing Delty Reports """
 
+    # pooled HTTP client shared by every request of the job
+    http = HTTPClient()
+
     def __init__(
             self,
             client_name,
@@ -42,11 +45,12 @@ class Delty:
         return cookies
 
     def _get_headers(self, req_result):
-        headers = delty['request']['headers']
+        headers = dict(delty['request']['headers'])
         headers['Authorization'] = req_result['auth']
+        return headers
 
     def request_auth(self):
-        req = requests.post(delty['auth']['URL'], json=delty['auth']['credentials'], headers = delty['auth']['headers'])
+        req = self.http.request('POST', delty['auth']['URL'], json=delty['auth']['credentials'], headers = delty['auth']['headers'])
         return req.json()
 
     def get_report(self):
@@ -58,7 +62,7 @@ class Delty:
 
         # GET request
         url = delty['request']['URL'].format(self.end_date)
-        get_req = requests.get(url, cookies=cookies, headers=headers)
+        get_req = self.http.request('GET', url, cookies=cookies, headers=headers)
 
         # read report into dataframe
         return pd.read_csv(io.StringIO(get_req.content.decode('utf-8')))
@@ -77,6 +81,7 @@ if __name__ == "__main__":
         rep = Delty(client_name=params['client_name'], start_date=params['start_date'], end_date=params['end_date'])
         df = rep.get_report()
         utils.save_data(df, params['bucket'], params['destpath'], params['destfname'])
+        print(f"HTTP requests: {Delty.http.summary()}")
 
     except Exception as e:
         raise JobError(e, Job_Arguments = args)
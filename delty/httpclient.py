@@ -0,0 +1,115 @@
+import time
+import threading
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+RETRY_STATUS = [429, 500, 502, 503, 504]
+
+
+def redact(url):
+    """Returns a URL without its query string (which can hold API keys), for logs & errors"""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}{parts.path}"
+
+
+class HTTPClient:
+    """HTTP client shared by every request of a job.
+
+    Each thread gets its own keep-alive session (requests.Session isn't thread safe) with a connection pool,
+    requests get a default timeout and are retried with exponential backoff on connection errors, 429 & 5xx.
+    The time & bytes of every request are recorded in history.
+    """
+
+    def __init__(self, timeout=(10, 300), max_retries=3, backoff_factor=1, pool_size=10):
+        """
+        Args:
+            timeout (tuple, optional): connect & read timeouts in seconds. Defaults to (10, 300).
+            max_retries (int, optional): max retries of a request. Defaults to 3.
+            backoff_factor (float, optional): retries wait backoff_factor * 2 ** (retry - 1) seconds (or the Retry-After header). Defaults to 1.
+            pool_size (int, optional): max connections kept alive per host & thread. Defaults to 10.
+        """
+        self.timeout = timeout
+        self.retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUS,
+            allowed_methods=None,
+            raise_on_status=False,
+        )
+        self.pool_size = pool_size
+        self.history = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _get_session(self):
+        if getattr(self._local, "session", None) is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=self.pool_size,
+                pool_maxsize=self.pool_size,
+                max_retries=self.retry,
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            self._local.session = session
+        return self._local.session
+
+    def _record(self, method, url, status, seconds, size):
+        entry = {
+            "method": method,
+            "url": redact(url),
+            "status": status,
+            "seconds": round(seconds, 3),
+            "bytes": size,
+        }
+        with self._lock:
+            self.history.append(entry)
+        return entry
+
+    def request(self, method, url, stream=False, **kwargs):
+        """Sends a request.
+
+        Args:
+            method (str): HTTP method
+            url (str): URL
+            stream (bool, optional): don't read the body yet, read it with iter_content (use the response as a context manager). Defaults to False.
+            kwargs: arguments of requests.Session.request (params, data, json, headers, auth, ...)
+
+        Raises:
+            requests.HTTPError: if the response status is an error, once retries are exhausted
+
+        Returns:
+            requests.Response: response
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        start = time.perf_counter()
+        r = self._get_session().request(method, url, stream=stream, **kwargs)
+        size = None if stream else len(r.content)
+        r.request_stats = self._record(
+            method, url, r.status_code, time.perf_counter() - start, size
+        )
+        if not r.ok:
+            raise requests.HTTPError(
+                f"{r.status_code} {r.reason} for {method} {redact(url)}: {r.text[:500]}",
+                response=r,
+            )
+        return r
+
+    def iter_content(self, response, chunk_size=1024 ** 2):
+        """Reads the body of a streamed response in chunks, and adds its size to the request's history"""
+        size = 0
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            size += len(chunk)
+            yield chunk
+        response.request_stats["bytes"] = size
+
+    def summary(self):
+        """Returns the number of requests, and their total time & bytes"""
+        with self._lock:
+            return {
+                "requests": len(self.history),
+                "seconds": round(sum(h["seconds"] for h in self.history), 3),
+                "bytes": sum(h["bytes"] or 0 for h in self.history),
+            }
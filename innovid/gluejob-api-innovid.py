@@ -1,8 +1,8 @@
-import io
 import json
 import time
+import asyncio
 import boto3
-import requests
+import tempfile
 import pandas as pd
 from zipfile import ZipFile
 from pathlib import Path
@@ -14,13 +14,32 @@ from awsglue.utils import getResolvedOptions
 import sys
 from config import innovid
 import utils
+from httpclient import HTTPClient
 from utils import JobError
 
 
+def get_optional_arg(name, default=None):
+    """Returns an optional job argument (getResolvedOptions fails on missing arguments)"""
+    if f"--{name}" in sys.argv:
+        return getResolvedOptions(sys.argv, [name])[name]
+    return default
+
+
 class Innovid:
     """Class for representing Innovid Reports"""
 
-    def __init__(self, client_name, start_date=None, end_date=None):
+    # pooled HTTP client shared by every report of the job
+    http = HTTPClient()
+
+    def __init__(
+        self,
+        client_name,
+        start_date=None,
+        end_date=None,
+        poll_interval=5,
+        max_poll_interval=60,
+        poll_timeout=1800,
+    ):
 
         """Constructor for Innovid Report.
 
@@ -28,6 +47,9 @@ class Innovid:
             client_name (string)
             (optional) end_date (string): End date of the report. Date format: 'YYYY-MM-DD' (Default: yesterday, inclusive)
             (optional) days_back (int): Number of days from the end date to be included in the report. (Default: 3, inclusive)
+            (optional) poll_interval (float): Seconds before the second status check, doubled after each check. (Default: 5)
+            (optional) max_poll_interval (float): Max seconds between status checks. (Default: 60)
+            (optional) poll_timeout (float): Seconds to wait for the report before giving up. (Default: 1800)
 
         """
         self.client_name = client_name
@@ -35,7 +57,11 @@ class Innovid:
         self.end_date = end_date
         self.user_email = innovid["credentials"]["user_email"]
         self.user_password = innovid["credentials"]["user_password"]
+        self.auth = HTTPBasicAuth(self.user_email, self.user_password)
         self.report_url = None
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.poll_timeout = poll_timeout
 
     def request_report(self):
         """Used to request the report.
@@ -54,20 +80,13 @@ class Innovid:
         )
 
         # at this point, the report is being requested
+        r = self.http.request("GET", token_req_url, auth=self.auth)
         try:
-            r = requests.get(
-                token_req_url, auth=HTTPBasicAuth(self.user_email, self.user_password)
-            )
             rs_token = json.loads(r.text)["data"]["reportStatusToken"]
+        except (ValueError, KeyError, TypeError):
+            raise Exception(r.text)
 
-            print("The report has been requested.")
-        except:
-            raise Exception(
-                requests.get(
-                    token_req_url,
-                    auth=HTTPBasicAuth(self.user_email, self.user_password),
-                ).text
-            )
+        print("The report has been requested.")
 
         return rs_token
 
@@ -78,13 +97,14 @@ class Innovid:
         There are 3 possible report status: 'IN_PROCESS' (report is still being built), 'FAIL' (failed to build the report),
         READY (report is ready).
 
+        Returns:
+            report_status (string)
+
         """
         req_url = innovid["request"]["statusURL"].format(token=status_token)
-        req_data = json.loads(
-            requests.get(
-                req_url, auth=HTTPBasicAuth(self.user_email, self.user_password)
-            ).text
-        )["data"]
+        req_data = json.loads(self.http.request("GET", req_url, auth=self.auth).text)[
+            "data"
+        ]
 
         report_status = req_data["reportStatus"]
 
@@ -95,45 +115,264 @@ class Innovid:
         elif report_status == "READY":
             self.report_url = req_data["reportUrl"]
             print("Report is ready")
+        return report_status
+
+    async def wait_for_report(self, status_token):
+        """Polls the status of a requested report until it's ready.
+
+        The first checks are a few seconds apart, the interval then doubles up to max_poll_interval.
+        Status checks run in a thread, so several reports can be polled together in one event loop (asyncio.gather).
+
+        Input:
+            status_token (string): token returned by 'request_report'
+
+        Returns:
+            report_url (string)
+
+        Raises:
+            Exception: if the report failed to build
+            TimeoutError: if the report is still not ready after poll_timeout seconds
+
+        """
+        loop = asyncio.get_running_loop()
+        start_time = time.monotonic()
+        interval = self.poll_interval
+        while True:
+            report_status = await loop.run_in_executor(
+                None, self.check_report_status, status_token
+            )
+            time_elapsed = time.monotonic() - start_time
+            if report_status == "READY":
+                print(f"Time elapsed: {round(time_elapsed / 60, 2)} minute(s).")
+                return self.report_url
+            if report_status == "FAIL":
+                raise Exception(f"Report request has failed: {self.client_name}")
+            if time_elapsed >= self.poll_timeout:
+                raise TimeoutError(
+                    f"Failed to get the report after {round(self.poll_timeout / 60)} minutes."
+                )
+            await asyncio.sleep(min(interval, self.poll_timeout - time_elapsed))
+            interval = min(interval * 2, self.max_poll_interval)
+
+    def iter_report(self, chunksize=100000, dtype=None):
+        """Downloads a ready report and reads it in chunks, so memory stays bounded whatever the report size.
+
+        The zip is downloaded in chunks into a spooled temporary file (kept in memory up to 64MB, then on disk),
+        and its CSV is decompressed while it's read.
+
+        Input:
+            (optional) chunksize (int): Number of rows per chunk. (Default: 100000)
+            (optional) dtype (dict): Column types, skips type inference on every chunk. (Default: innovid["dtype"], if any)
+
+        Yields:
+            pd.DataFrame
+
+        """
+        with tempfile.SpooledTemporaryFile(max_size=64 * 1024 ** 2) as spool:
+            with self.http.request("GET", self.report_url, stream=True) as r:
+                for block in self.http.iter_content(r, chunk_size=1024 ** 2):
+                    spool.write(block)
+            spool.seek(0)
+            with ZipFile(spool) as temp, temp.open(temp.namelist()[0]) as f:
+                yield from pd.read_csv(
+                    f, chunksize=chunksize, dtype=dtype or innovid.get("dtype")
+                )
+
+    def download_report(self):
+        """Downloads a ready report.
+
+        Returns:
+            pd.DataFrame
+
+        """
+        return pd.concat(self.iter_report(), ignore_index=True)
 
     def get_report(self):
         """Used to request the report.
 
-        This function will get the report and save it into a local folder. Exact location will be printed after the function has finished running.
+        This function will request the report, wait until it's ready and download it.
 
         """
 
         rs_token = self.request_report()
-
-        # check the report status every minute
-        # prints time and time elapsed every 5 minutes
-        # the loop will stop trying to get the report after 30 minutes have elapsed.
-        start_time = time.time()
         print("In the process of getting the report... \nCurrent time:", time.ctime())
-        self.check_report_status(rs_token)
-        while self.report_url is None:
-            time.sleep(60)
-            time_elapsed = time.time() - start_time
-            self.check_report_status(rs_token)
-            if time_elapsed > 1800:
-                print("Failed to get the report after 30 minutes.")
-                break
-            elif round(time_elapsed / 60) % 3 == 0:
-                print(
-                    "Still getting the report...\nCurrent time: {}.\nTime elapsed: {} minutes".format(
-                        time.ctime(), round(time_elapsed / 60)
-                    )
-                )
+        asyncio.run(self.wait_for_report(rs_token))
+        return self.download_report()
 
-        # if report is ready before 30 minutes is up:
-        else:
-            # get zipped folder inside the url
-            r = requests.get(self.report_url)
-            temp = ZipFile(io.BytesIO(r.content))
-            time_elapsed = time.time() - start_time
 
-            print("Time elapsed: {round(time_elapsed/60, 2)} minute(s).")
-            return pd.read_csv(temp.open(temp.namelist()[0]))
+def get_clients(client_arg):
+    """Returns the client names of the 'Client' job argument: 'All' (every client of the config) or a comma separated list"""
+    if client_arg == "All":
+        return list(innovid["credentials"]["client_id"])
+    return [c.strip() for c in client_arg.split(",") if c.strip()]
+
+
+async def run_client(params, **kwargs):
+    """Requests, waits for, downloads and saves the report of one client.
+
+    The report is streamed to S3 chunk by chunk (see Innovid.iter_report and utils.save_chunks).
+    Blocking calls (HTTP requests, S3) run in threads, so the reports of several clients are processed together.
+
+    Input:
+        params (dict): job parameters of the client (see utils.get_params)
+        kwargs: polling settings (see Innovid)
+
+    """
+    loop = asyncio.get_running_loop()
+    rep = Innovid(
+        client_name=params["client_name"],
+        start_date=params["start_date"],
+        end_date=params["end_date"],
+        **kwargs,
+    )
+    rs_token = await loop.run_in_executor(None, rep.request_report)
+    await rep.wait_for_report(rs_token)
+    await loop.run_in_executor(
+        None,
+        utils.save_chunks,
+        rep.iter_report(),
+        params["bucket"],
+        params["destpath"],
+        params["destfname"],
+    )
+    print(f"Done: {params['client_name']}")
+
+
+async def run_all(names, jobs):
+    """Runs coroutines concurrently, and raises the failures once every coroutine is done"""
+    results = await asyncio.gather(*jobs, return_exceptions=True)
+    failures = {
+        n: f"{type(r).__name__}: {r}"
+        for n, r in zip(names, results)
+        if isinstance(r, Exception)
+    }
+    if failures:
+        raise Exception(f"{len(failures)} of {len(names)} reports failed: {failures}")
+
+
+async def run_clients(args, client_names, **kwargs):
+    """Gets the reports of several clients concurrently.
+
+    Every report is requested up front, and each one is downloaded and saved as soon as it's ready,
+    so the job takes about as long as the slowest report.
+
+    Input:
+        args (dict): job arguments
+        client_names (list)
+        kwargs: polling settings (see Innovid)
+
+    Raises:
+        Exception: if any client failed, once every other client is done
+
+    """
+    await run_all(
+        client_names,
+        [
+            run_client(utils.get_params({**args, "Client": c}, "innovid"), **kwargs)
+            for c in client_names
+        ],
+    )
+
+
+def split_date_range(start_date, end_date, days):
+    """Splits a date range into sub-ranges of a number of days.
+
+    Input:
+        start_date (string): Date format: 'YYYY-MM-DD' (inclusive)
+        end_date (string): Date format: 'YYYY-MM-DD' (inclusive)
+        days (int): Number of days per sub-range, the last one may be shorter
+
+    Returns:
+        list: (start_date, end_date) of each sub-range, inclusive
+
+    """
+    start = datetime.strptime(start_date, "%Y-%m-%d")
+    end = datetime.strptime(end_date, "%Y-%m-%d")
+    sub_ranges = []
+    while start <= end:
+        sub_end = min(start + timedelta(days=days - 1), end)
+        sub_ranges.append((f"{start:%Y-%m-%d}", f"{sub_end:%Y-%m-%d}"))
+        start = sub_end + timedelta(days=1)
+    return sub_ranges
+
+
+class Checkpoint:
+    """Manifest of the finished sub-ranges of a backfill, saved as JSON in S3 after each sub-range"""
+
+    def __init__(self, bucket, key):
+        self.bucket = bucket
+        self.key = key
+        self.s3 = boto3.client("s3")
+        self.lock = asyncio.Lock()
+        try:
+            body = self.s3.get_object(Bucket=bucket, Key=key)["Body"].read()
+            self.done = json.loads(body)
+        except self.s3.exceptions.NoSuchKey:
+            self.done = {}
+
+    def is_done(self, start_date, end_date):
+        return f"{start_date}_{end_date}" in self.done
+
+    async def mark_done(self, start_date, end_date, path):
+        """Records a finished sub-range and the S3 path of its file"""
+        async with self.lock:
+            self.done[f"{start_date}_{end_date}"] = path
+            body = json.dumps(self.done, indent=2)
+            await asyncio.get_running_loop().run_in_executor(
+                None,
+                lambda: self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=body),
+            )
+
+
+async def run_sub_range(params, checkpoint, semaphore, **kwargs):
+    """Gets the report of one sub-range of a backfill, and records it in the checkpoint once saved"""
+    async with semaphore:
+        await run_client(params, **kwargs)
+    await checkpoint.mark_done(
+        params["start_date"], params["end_date"], params["destpath"] + params["destfname"]
+    )
+
+
+async def run_backfill(args, client_names, days, max_concurrent=4, **kwargs):
+    """Gets the reports of a long date range as several smaller reports, concurrently and resumably.
+
+    The range is split into sub-ranges of a number of days, each one saved into its own file (suffixed with its dates).
+    Finished sub-ranges are recorded in a checkpoint manifest next to the files, and skipped when the job is run again.
+
+    Input:
+        args (dict): job arguments
+        client_names (list)
+        days (int): Number of days per sub-range
+        (optional) max_concurrent (int): Max number of reports requested at the same time. (Default: 4)
+        kwargs: polling settings (see Innovid)
+
+    Raises:
+        Exception: if any sub-range failed, once every other sub-range is done (they're skipped on the next run)
+
+    """
+    sub_ranges = split_date_range(args["StartDate"], args["EndDate"], days)
+    semaphore = asyncio.Semaphore(max_concurrent)
+    names, jobs = [], []
+    for c in client_names:
+        params = utils.get_params({**args, "Client": c}, "innovid")
+        checkpoint = Checkpoint(
+            params["bucket"],
+            f"{params['destpath']}backfill_{args['StartDate']}_{args['EndDate']}.json",
+        )
+        fname = Path(params["destfname"])
+        for start_date, end_date in sub_ranges:
+            if checkpoint.is_done(start_date, end_date):
+                print(f"Already done: {c} {start_date} - {end_date}")
+                continue
+            sub_params = {
+                **params,
+                "start_date": start_date,
+                "end_date": end_date,
+                "destfname": f"{fname.stem}_{start_date}_{end_date}{fname.suffix}",
+            }
+            names.append(f"{c} {start_date} - {end_date}")
+            jobs.append(run_sub_range(sub_params, checkpoint, semaphore, **kwargs))
+    await run_all(names, jobs)
 
 
 if __name__ == "__main__":
@@ -145,15 +384,24 @@ if __name__ == "__main__":
         if args["StartDate"] == "None":
             args["StartDate"] = utils.get_start_date(args["EndDate"], "innovid")
 
-        params = utils.get_params(args, "innovid")
-
-        rep = Innovid(
-            client_name=params["client_name"],
-            start_date=params["start_date"],
-            end_date=params["end_date"],
+        polling = dict(
+            max_poll_interval=float(get_optional_arg("MaxPollInterval", 60)),
+            poll_timeout=float(get_optional_arg("PollTimeout", 30)) * 60,
         )
-        df = rep.get_report()
-        utils.save_data(df, params["bucket"], params["destpath"], params["destfname"])
+        backfill_days = get_optional_arg("BackfillDays")
+        if backfill_days is None:
+            asyncio.run(run_clients(args, get_clients(args["Client"]), **polling))
+        else:
+            asyncio.run(
+                run_backfill(
+                    args,
+                    get_clients(args["Client"]),
+                    int(backfill_days),
+                    int(get_optional_arg("MaxConcurrentReports", 4)),
+                    **polling,
+                )
+            )
+        print(f"HTTP requests: {Innovid.http.summary()}")
 
     except Exception as e:
         raise JobError(e, Job_Arguments=args)
@@ -1,44 +1,87 @@
-import http.client
-import json
 import pandas as pd
+import ijson
 import sys
 import io
+import pickle
+import queue
+import tempfile
+import threading
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
+from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor
+from requests import HTTPError
 import boto3
 from awsglue.utils import getResolvedOptions
 from config import ispot
 import utils
 from utils import JobError
+from httpclient import HTTPClient
+from tokencache import TokenCache, FileTokenStore, DynamoDBTokenStore
+
+# pagination query parameters of the API (JSON:API style), the page size is set by ispot["request"]["page_size"]
+PAGE_NUMBER = "page[number]"
+PAGE_SIZE = "page[size]"
+
+
+def get_token_store():
+    """Returns the store of the access token: the DynamoDB table of ispot["token_cache"]["table"] (shared by every job),
+    or else a local file (ispot["token_cache"]["path"], defaults to a temp file)"""
+    settings = ispot.get("token_cache", {})
+    if settings.get("table"):
+        return DynamoDBTokenStore(settings["table"])
+    return FileTokenStore(settings.get("path"))
 
 
 class iSpot:
-    def __init__(self, client_name, start_date, end_date) -> None:
+    # pooled HTTP client shared by every request of the job
+    http = HTTPClient()
+
+    def __init__(
+        self, client_name, start_date, end_date, page_size=None, batch_size=10000, max_workers=4
+    ) -> None:
+        """
+        Args:
+            client_name (str): client name
+            start_date (str): start date (YYYY-MM-DD)
+            end_date (str): end date (YYYY-MM-DD)
+            page_size (int, optional): records per page, pages are fetched concurrently. Defaults to ispot["request"]["page_size"], if none the data is fetched in one request.
+            batch_size (int, optional): records per dataframe built from a page. Defaults to 10000.
+            max_workers (int, optional): number of pages fetched at the same time. Defaults to 4.
+
+        The columns of the data (after renaming, see _rename_fields) can be fixed with ispot["columns"],
+        otherwise batches are spooled to a temporary file until every column is known (see iter_data).
+        """
         self.client_name = client_name
         self.start_date = start_date
         self.end_date = end_date
         self.url = ispot["request"]["details"].format(
             start_date=start_date, end_date=end_date
         )
-        self.conn = http.client.HTTPSConnection(ispot["request"]["baseURL"])
+        self.base_url = f"https://{ispot['request']['baseURL']}"
+        self.page_size = page_size or ispot["request"].get("page_size")
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.columns = ispot.get("columns")
         self.df = None
-
-    def _decode(self, response):
-        r = response.read()
-        return json.loads(r.decode("utf-8"))
+        self.tokens = TokenCache(self._get_token, get_token_store())
 
     def _get_token(self):
-        self.conn.request(
+        """Requests a new access token (see TokenCache)
+
+        Returns:
+            access_token (str): token
+            expires_in (int): seconds before the token expires
+        """
+        response = self.http.request(
             ispot["auth"]["method"],
-            ispot["auth"]["URL"],
-            ispot["auth"]["payload"],
-            ispot["auth"]["headers"],
-        )
-        response = self._decode(self.conn.getresponse())
-        return response["access_token"]
+            urljoin(self.base_url, ispot["auth"]["URL"]),
+            data=ispot["auth"]["payload"],
+            headers=ispot["auth"]["headers"],
+        ).json()
+        return response["access_token"], response.get("expires_in", 3600)
 
-    def _get_params(self):
-        token = self._get_token()
+    def _get_params(self, token):
         headers = {"Authorization": ispot["request"]["authheaders"].format(token=token)}
         return ispot["request"]["payload"], headers
 
@@ -47,14 +90,137 @@ class iSpot:
         df.rename(columns={c: nc for c, nc in zip(df.columns, newcols)}, inplace=True)
         return df
 
-    def get_data(self):
-        payload, headers = self._get_params()
-        self.conn.request(ispot["request"]["method"], self.url, payload, headers)
-        data = self._decode(self.conn.getresponse())
-        df = pd.json_normalize(data["data"])
+    def _iter_records(self, response):
+        """Parses the records of a streamed response one by one (with ijson), without decoding the whole body"""
+        response.raw.decode_content = True
+        yield from ijson.items(response.raw, "data.item", use_float=True)
+
+    def _get_page(self, page=None):
+        """Fetches a page of records with the cached access token, and yields its dataframes batch by batch.
+
+        If the token is rejected (401), it's dropped from the cache and the page is fetched again with a new token.
+        """
+        for attempt in range(2):
+            token = self.tokens.get()
+            payload, headers = self._get_params(token)
+            try:
+                yield from self._read_page(payload, headers, page)
+                return
+            except HTTPError as e:
+                if e.response is None or e.response.status_code != 401 or attempt:
+                    raise
+                print("Access token rejected, getting a new one")
+                self.tokens.invalidate(token)
+
+    def _read_page(self, payload, headers, page=None):
+        """Fetches a page of records, and yields dataframes of batch_size records as they're parsed"""
+        params = {} if page is None else {PAGE_NUMBER: page, PAGE_SIZE: self.page_size}
+        batch = []
+        with self.http.request(
+            ispot["request"]["method"],
+            urljoin(self.base_url, self.url),
+            params=params,
+            data=payload,
+            headers=headers,
+            stream=True,
+        ) as r:
+            for record in self._iter_records(r):
+                batch.append(record)
+                if len(batch) == self.batch_size:
+                    yield pd.json_normalize(batch)
+                    batch = []
+        if batch:
+            yield pd.json_normalize(batch)
+
+    def _format(self, df):
         df["client_name"] = self.client_name
         return self._rename_fields(df)
 
+    def _page_worker(self, page, out, stop):
+        """Puts the batches of a page into a queue, then its number of records (or the error that stopped it)"""
+
+        def put(item):
+            # the queue is bounded: wait for the reader, unless it stopped reading
+            while not stop.is_set():
+                try:
+                    out.put(item, timeout=1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        try:
+            count = 0
+            for df in self._get_page(page):
+                count += len(df)
+                if not put(df):
+                    return
+            put(count)
+        except Exception as e:
+            put(e)
+
+    def _iter_batches(self):
+        """Fetches the data page by page, and yields it in dataframes of batch_size records.
+
+        Pages are fetched max_workers at a time, until a page has less than page_size records.
+        Each page hands its batches over through a small queue, so at most 2 parsed batches per page are held in memory.
+        Batches are yielded in page order.
+        """
+        if not self.page_size:
+            yield from (self._format(df) for df in self._get_page())
+            return
+        page = 1
+        stop = threading.Event()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            try:
+                while True:
+                    queues = [queue.Queue(maxsize=2) for _ in range(self.max_workers)]
+                    for n, q in enumerate(queues, start=page):
+                        executor.submit(self._page_worker, n, q, stop)
+                    for q in queues:
+                        item = q.get()
+                        while isinstance(item, pd.DataFrame):
+                            yield self._format(item)
+                            item = q.get()
+                        if isinstance(item, Exception):
+                            raise item
+                        if item < self.page_size:
+                            return
+                    page += self.max_workers
+            finally:
+                stop.set()
+
+    def iter_data(self):
+        """Yields the data in dataframes of batch_size records, all with the same columns (to be saved into one CSV).
+
+        json_normalize only creates the columns of the fields found in a batch, so batches are aligned on:
+        - the columns of ispot["columns"], if set: batches are streamed, a field missing from the config raises an error.
+        - otherwise, the columns of every batch: batches are spooled to a temporary file while they're fetched,
+          then read back one by one with every column.
+
+        Raises:
+            ValueError: if a batch has fields missing from ispot["columns"]
+        """
+        if self.columns is not None:
+            for df in self._iter_batches():
+                unknown = [c for c in df.columns if c not in self.columns]
+                if unknown:
+                    raise ValueError(f"Fields missing from ispot['columns']: {unknown}")
+                yield df.reindex(columns=self.columns)
+            return
+        with tempfile.TemporaryFile() as spool:
+            columns, n_batches = {}, 0
+            for df in self._iter_batches():
+                columns.update(dict.fromkeys(df.columns))
+                pickle.dump(df, spool, protocol=pickle.HIGHEST_PROTOCOL)
+                n_batches += 1
+            spool.seek(0)
+            for _ in range(n_batches):
+                yield pickle.load(spool).reindex(columns=list(columns))
+
+    def get_data(self):
+        return pd.concat(list(self.iter_data()), ignore_index=True)
+
 
 if __name__ == "__main__":
     try:
@@ -68,8 +234,8 @@ if __name__ == "__main__":
         params = utils.get_params(args, "ispot")
 
         rep = iSpot(params["client_name"], params["start_date"], params["end_date"])
-        df = rep.get_data()
-        utils.save_data(df, params["bucket"], params["destpath"], params["destfname"])
+        utils.save_chunks(rep.iter_data(), params["bucket"], params["destpath"], params["destfname"])
+        print(f"HTTP requests: {iSpot.http.summary()}")
 
     except Exception as e:
         raise JobError(e, Job_Arguments=args)
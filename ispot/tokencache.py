@@ -0,0 +1,150 @@
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+import boto3
+
+
+class FileTokenStore:
+    """Stores the token in a local JSON file (only readable by the owner), locked with a lock file.
+
+    Shared by the processes & jobs of the same host, it's also the local stand-in of DynamoDBTokenStore.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(tempfile.gettempdir(), "ispot-token.json")
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def save(self, record):
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(record, f)
+        os.replace(tmp, self.path)
+
+    def delete(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    @contextmanager
+    def lock(self):
+        with open(f"{self.path}.lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class DynamoDBTokenStore:
+    """Stores the token in a DynamoDB table (string partition key 'TokenID'), shared by every job.
+
+    The lock is an item put only if it doesn't exist or expired, so a crashed job doesn't hold it forever.
+    """
+
+    def __init__(self, table, token_id="ispot", lock_timeout=60, region=None):
+        self.table = boto3.resource("dynamodb", region_name=region).Table(table)
+        self.token_id = token_id
+        self.lock_timeout = lock_timeout
+
+    def load(self):
+        item = self.table.get_item(Key={"TokenID": self.token_id}, ConsistentRead=True).get("Item")
+        if item is None:
+            return None
+        return {"access_token": item["AccessToken"], "expires_at": float(item["ExpiresAt"])}
+
+    def save(self, record):
+        self.table.put_item(
+            Item={
+                "TokenID": self.token_id,
+                "AccessToken": record["access_token"],
+                "ExpiresAt": int(record["expires_at"]),
+            }
+        )
+
+    def delete(self):
+        self.table.delete_item(Key={"TokenID": self.token_id})
+
+    @contextmanager
+    def lock(self):
+        lock_id = f"{self.token_id}#lock"
+        owner = str(uuid.uuid4())
+        conflict = self.table.meta.client.exceptions.ConditionalCheckFailedException
+        while True:
+            try:
+                self.table.put_item(
+                    Item={"TokenID": lock_id, "Owner": owner, "ExpiresAt": int(time.time() + self.lock_timeout)},
+                    ConditionExpression="attribute_not_exists(TokenID) OR ExpiresAt < :now",
+                    ExpressionAttributeValues={":now": int(time.time())},
+                )
+                break
+            except conflict:
+                time.sleep(0.5)
+        try:
+            yield
+        finally:
+            try:
+                self.table.delete_item(
+                    Key={"TokenID": lock_id},
+                    ConditionExpression="#owner = :owner",
+                    ExpressionAttributeNames={"#owner": "Owner"},
+                    ExpressionAttributeValues={":owner": owner},
+                )
+            except conflict:
+                pass
+
+
+class TokenCache:
+    """Caches an OAuth access token until shortly before it expires.
+
+    When the token must be refreshed, only one worker (thread, process or job sharing the store) fetches a new one:
+    the others wait for the lock, then find the fresh token in the store.
+    """
+
+    def __init__(self, fetch, store=None, refresh_margin=300):
+        """
+        Args:
+            fetch (function): returns a new token as (access_token, expires_in seconds)
+            store (optional): where the token is stored, FileTokenStore or DynamoDBTokenStore. Defaults to FileTokenStore().
+            refresh_margin (int, optional): seconds before expiry when the token is refreshed. Defaults to 300.
+        """
+        self.fetch = fetch
+        self.store = store or FileTokenStore()
+        self.refresh_margin = refresh_margin
+        self._lock = threading.Lock()
+
+    def _is_valid(self, record):
+        return record is not None and record["expires_at"] - self.refresh_margin > time.time()
+
+    def get(self):
+        """Returns the cached token, or a new one if it's missing or about to expire"""
+        record = self.store.load()
+        if self._is_valid(record):
+            return record["access_token"]
+        with self._lock, self.store.lock():
+            record = self.store.load()
+            if not self._is_valid(record):
+                access_token, expires_in = self.fetch()
+                record = {"access_token": access_token, "expires_at": time.time() + expires_in}
+                self.store.save(record)
+                print("New access token")
+            return record["access_token"]
+
+    def invalidate(self, access_token):
+        """Drops a rejected token (unless another worker already replaced it)"""
+        with self._lock, self.store.lock():
+            record = self.store.load()
+            if record is not None and record["access_token"] == access_token:
+                self.store.delete()
@@ -22,6 +22,39 @@ def save_data(df, bucket, destpath, destfname):
     s3_obj = s3.Object(bucket, destpath+destfname)
     s3_obj.put(Body=csv_buffer.getvalue())
     print("Data has been saved.")
+
+def save_chunks(chunks, bucket, destpath, destfname, part_size=8 * 1024 ** 2):
+    """Saves dataframe chunks into one CSV in S3 without holding the whole file in memory.
+
+    Chunks are buffered into parts of part_size (S3 min: 5MB) sent with a multipart upload.
+    Files smaller than one part are saved with a single put.
+    """
+    s3 = boto3.client('s3')
+    key = destpath + destfname
+    buffer = io.BytesIO()
+    upload_id = None
+    parts = []
+    try:
+        for i, df in enumerate(chunks):
+            buffer.write(df.to_csv(sep=",", index=False, header=i == 0).encode("utf-8"))
+            if buffer.tell() >= part_size:
+                if upload_id is None:
+                    upload_id = s3.create_multipart_upload(Bucket=bucket, Key=key)['UploadId']
+                r = s3.upload_part(Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=len(parts) + 1, Body=buffer.getvalue())
+                parts.append({'ETag': r['ETag'], 'PartNumber': len(parts) + 1})
+                buffer = io.BytesIO()
+        if upload_id is None:
+            s3.put_object(Bucket=bucket, Key=key, Body=buffer.getvalue())
+        else:
+            if buffer.tell():
+                r = s3.upload_part(Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=len(parts) + 1, Body=buffer.getvalue())
+                parts.append({'ETag': r['ETag'], 'PartNumber': len(parts) + 1})
+            s3.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={'Parts': parts})
+    except Exception:
+        if upload_id is not None:
+            s3.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        raise
+    print("Data has been saved.")
     
 def get_params(args, source):
     params = {}
@@ -2,15 +2,18 @@ import io
 import sys
 import json
 import boto3
-import requests
 import pandas as pd
 from datetime import datetime
 from awsglue.utils import getResolvedOptions
 from config import similarweb
 from utils import JobError
 import utils
+from httpclient import HTTPClient
 
 class SimilarWebApp:
+
+    # pooled HTTP client shared by every request of the job
+    http = HTTPClient()
     
     def __init__(self, client_name, app_id, data_type, granularity, start_month, end_month, app_os = "Google") -> None:
         self.client_name = client_name
@@ -31,18 +34,18 @@ class SimilarWebApp:
         
     def _get_response(self):
         url = self._get_url()
-        return requests.request(similarweb['request']['method'], url, headers={}, data={})
+        return self.http.request(similarweb['request']['method'], url, headers={}, data={})
     
     def _load_response(self):
         response = self._get_response()
-        return json.loads(response.text)[self.data_type]
+        try:
+            return json.loads(response.text)[self.data_type]
+        except (ValueError, KeyError):
+            raise Exception(f"Error Code: {response}: {response.text[:500]}")
     
     def _get_raw_data(self):
-        try:
-            raw_data = self._load_response()
-            return pd.json_normalize(raw_data)
-        except:
-            print(f"Error Code: {self._get_response()}")
+        raw_data = self._load_response()
+        return pd.json_normalize(raw_data)
             
     def _add_details(self, df):
         df['client_name'] = self.client_name
@@ -77,9 +80,9 @@ if __name__ == "__main__":
         app_df = app.get_data()
         utils.save_data(app_df, params['bucket'], params['destpath'], app.get_fname())
         print(f"Saved to: {params['destpath']}{app.get_fname()}")
+        print(f"HTTP requests: {SimilarWebApp.http.summary()}")
         
     except Exception as e:
-        args['ErrorCode'] = app._get_response()
         raise JobError(e, Job_Arguments = args)
     
     